@@ -0,0 +1,63 @@
+import argparse
+import gym_remote as gr
+import numpy as np
+import sys
+import time
+
+
+def make_frames(count, shape=(224, 320, 3), seed=0):
+    # A scrolling background with a moving sprite approximates emulator frames
+    rng = np.random.RandomState(seed)
+    tiles = rng.randint(0, 256, (shape[0] // 8, shape[1] // 4, shape[2])).astype(np.uint8)
+    background = tiles.repeat(8, axis=0).repeat(8, axis=1)
+    frames = []
+    for i in range(count):
+        x = i % shape[1]
+        frame = background[:, x:x + shape[1]].copy()
+        y = (i * 3) % (shape[0] - 16)
+        frame[y:y + 16, 100:116] = 255
+        frames.append(frame)
+    return frames
+
+
+def measure(frames, compression, keyframe_interval):
+    compress, decompress = gr.bridge._COMPRESSORS[compression] if compression else (None, None)
+    sender = gr.NpChannel(frames[0].shape, np.uint8)
+    receiver = gr.NpChannel(frames[0].shape, np.uint8)
+    sender.set_base(None)
+    receiver.set_base(None)
+    nbytes = 0
+    encode = 0
+    decode = 0
+    for frame in frames:
+        sender.value = frame
+        start = time.perf_counter()
+        data = sender.encode(compress, keyframe_interval)
+        encode += time.perf_counter() - start
+        nbytes += len(data)
+        start = time.perf_counter()
+        receiver.decode(data, decompress, keyframe_interval)
+        decode += time.perf_counter() - start
+    assert (receiver.value == frames[-1]).all()
+    count = len(frames)
+    return nbytes / count, encode / count * 1e6, decode / count * 1e6
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Benchmark inline observation encodings')
+    parser.add_argument('--frames', '-n', type=int, default=300, help='Number of synthetic frames')
+    parser.add_argument('--keyframe-interval', '-k', type=int, default=30, help='Frames between keyframes for delta encodings')
+    args = parser.parse_args(argv)
+
+    frames = make_frames(args.frames)
+    for compression in (None,) + gr.Bridge.COMPRESSIONS:
+        for keyframe_interval in (0, args.keyframe_interval):
+            name = compression or 'raw'
+            if keyframe_interval:
+                name += '+delta'
+            nbytes, encode, decode = measure(frames, compression, keyframe_interval)
+            print('%-12s %10.0f bytes/step %8.1f us encode %8.1f us decode' % (name, nbytes, encode, decode))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+import argparse
+import gym_remote as gr
+import numpy as np
+import sys
+import timeit
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Benchmark IntFoldChannel folding')
+    parser.add_argument('--buttons', '-b', type=int, default=12, help='Number of binary folds')
+    parser.add_argument('--number', '-n', type=int, default=100000, help='Calls per measurement')
+    args = parser.parse_args(argv)
+
+    channel = gr.IntFoldChannel([2] * args.buttons, np.uint8)
+    action = np.random.RandomState(0).randint(0, 2, args.buttons).astype(np.int8)
+    code = channel.parse(action)
+    cases = [
+        ('parse/table', lambda: channel.parse(action)),
+        ('parse/arith', lambda: channel._fold(action)),
+        ('parse/list/table', lambda: channel.parse(list(action))),
+        ('parse/list/arith', lambda: channel._fold(np.asarray(list(action)))),
+        ('unparse/table', lambda: channel.unparse(code)),
+        ('unparse/arith', lambda: channel._unfold(code)),
+    ]
+    for name, call in cases:
+        elapsed = min(timeit.repeat(call, number=args.number, repeat=3))
+        print('%-18s %8.3f us/call' % (name, elapsed / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
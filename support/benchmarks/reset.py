@@ -0,0 +1,37 @@
+import argparse
+import retro
+import retro_contest.local
+import sys
+import time
+
+
+def time_resets(env, resets, steps):
+    env.reset()
+    elapsed = 0
+    for i in range(resets):
+        # Steps between resets are untimed, so the emulator has moved on
+        for j in range(steps):
+            env.step(env.action_space.sample())
+        t = time.perf_counter()
+        env.reset()
+        elapsed += time.perf_counter() - t
+    return resets / elapsed
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Benchmark retro resets with and without the start state snapshot')
+    parser.add_argument('game', type=str, help='Name of the game to reset')
+    parser.add_argument('state', type=str, default=retro.State.DEFAULT, nargs='?', help='Name of initial state')
+    parser.add_argument('--resets', '-n', type=int, default=200, help='Timed resets per case')
+    parser.add_argument('--steps', '-s', type=int, default=10, help='Untimed steps between resets')
+    args = parser.parse_args(argv)
+
+    for name, fast_reset in (('full', False), ('snapshot', True)):
+        env = retro_contest.local.make(args.game, args.state, fast_reset=fast_reset)
+        rate = time_resets(env, args.resets, args.steps)
+        env.close()
+        print('%-10s %10.0f resets/s' % (name, rate))
+
+
+if __name__ == '__main__':
+    main()
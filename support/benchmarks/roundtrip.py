@@ -0,0 +1,67 @@
+import argparse
+import gym_remote as gr
+import sys
+import tempfile
+import time
+
+
+def make_pair(base, framing, wakeup='socket', memory='file'):
+    server = gr.Bridge(base, framing=framing, wakeup=wakeup, memory=memory)
+    server.add_channel('ac', gr.IntFoldChannel([2] * 12, 'uint8'))
+    server.add_channel('ob', gr.NpChannel((224, 320, 3), 'uint8'))
+    server.add_channel('reward', gr.FloatChannel())
+    server.add_channel('done', gr.BoolChannel())
+    server.add_channel('reset', gr.BoolChannel())
+    server.listen()
+    client = gr.Bridge(base)
+    client.connect()
+    server.server_accept()
+    client.configure_client()
+    return client, server
+
+
+def roundtrip(framing, steps, wakeup='socket', memory='file'):
+    with tempfile.TemporaryDirectory() as base:
+        client, server = make_pair(base, framing, wakeup, memory)
+        ch_ac = client._channels['ac']
+        ch_reward = server._channels['reward']
+        ch_done = server._channels['done']
+        ch_ob = server._channels['ob']
+        action = [0] * 12
+        start = time.perf_counter()
+        for i in range(steps):
+            action[i % 12] ^= 1
+            ch_ac.value = action
+            client.send()
+            server.recv()
+            ch_ob.value[i % 224, 0, 0] = i & 0xff
+            ch_ob.dirty = True
+            ch_reward.value = i * 0.5
+            ch_done.value = False
+            server.send()
+            client.recv()
+        elapsed = time.perf_counter() - start
+        client.close()
+        server.close()
+    return elapsed
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Benchmark gym_remote Bridge round trips')
+    parser.add_argument('--steps', '-n', type=int, default=100000, help='Number of round trips per framing')
+    parser.add_argument('--framing', '-f', type=str, nargs='*', default=gr.Bridge.FRAMINGS, help='Framings to compare')
+    parser.add_argument('--wakeup', '-w', type=str, nargs='*', default=gr.Bridge.WAKEUPS, help='Wakeups to compare')
+    parser.add_argument('--memory', '-m', type=str, default='file', choices=gr.Bridge.MEMORIES, help='Shared memory backing')
+    args = parser.parse_args(argv)
+
+    for wakeup in args.wakeup:
+        # Framing only applies to update messages sent over the socket
+        framings = args.framing if wakeup == 'socket' else args.framing[:1]
+        for framing in framings:
+            elapsed = roundtrip(framing, args.steps, wakeup, args.memory)
+            name = '%s/%s' % (wakeup, framing) if wakeup == 'socket' else wakeup
+            print('%-14s %10.0f steps/s %8.2f us/step' % (name, args.steps / elapsed, elapsed / args.steps * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+import argparse
+import gym_remote as gr
+import resource
+import sys
+import tempfile
+import tracemalloc
+
+from benchmarks.roundtrip import make_pair
+
+
+def soak(framing, steps, interval):
+    with tempfile.TemporaryDirectory() as base:
+        client, server = make_pair(base, framing)
+        ch_ac = client._channels['ac']
+        ch_reward = server._channels['reward']
+        ch_done = server._channels['done']
+        action = [0] * 12
+        samples = []
+        tracemalloc.start()
+        for i in range(steps):
+            action[i % 12] ^= 1
+            ch_ac.value = action
+            client.send()
+            server.recv()
+            ch_reward.value = i * 0.5
+            ch_done.value = False
+            server.send()
+            client.recv()
+            if i % interval == 0:
+                traced = tracemalloc.get_traced_memory()[0]
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                samples.append((i, traced, rss))
+                print('%-8s %10d steps %10d B traced %8d KiB max RSS' % (framing, i, traced, rss))
+        tracemalloc.stop()
+        client.close()
+        server.close()
+    return samples
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Check that gym_remote Bridge memory stays flat over long runs')
+    parser.add_argument('--steps', '-n', type=int, default=2000000, help='Number of round trips per framing')
+    parser.add_argument('--interval', '-i', type=int, default=100000, help='Steps between memory samples')
+    parser.add_argument('--framing', '-f', type=str, nargs='*', default=gr.Bridge.FRAMINGS, help='Framings to soak')
+    args = parser.parse_args(argv)
+
+    flat = True
+    for framing in args.framing:
+        samples = soak(framing, args.steps, args.interval)
+        # Ignore the first sample, which includes warmup allocations
+        traced = [sample[1] for sample in samples[1:]]
+        if traced and max(traced) - min(traced) > 4096:
+            print('%s: traced memory grew by %d B' % (framing, max(traced) - min(traced)))
+            flat = False
+    if not flat:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
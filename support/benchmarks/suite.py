@@ -0,0 +1,159 @@
+import argparse
+import functools
+import gym
+import gym.spaces
+import json
+import numpy as np
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+from gym_remote.client import RemoteEnv
+from gym_remote.server import RemoteEnvWrapper
+from gym_remote.testing import BitEnv, MultiBitEnv, StepEnv, run_wrapper
+
+
+class ObEnv(gym.Env):
+    def __init__(self, shape):
+        self.action_space = gym.spaces.Discrete(2)
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8)
+        self.ob = np.zeros(shape, np.uint8)
+
+    def step(self, action):
+        self.ob.flat[0] ^= 1
+        return self.ob, 0.0, False, {}
+
+    def reset(self):
+        return self.ob
+
+
+# Each channel type is exercised through the action or observation of an env
+ENVS = {
+    'int': (BitEnv, lambda i: i % 4),
+    'step': (StepEnv, lambda i: 0),
+    'int_fold': (MultiBitEnv, lambda i: np.array([i & 1, 0, 0], np.int8)),
+    'np_2x2': (functools.partial(ObEnv, (2, 2)), lambda i: i & 1),
+    'np_84x84x3': (functools.partial(ObEnv, (84, 84, 3)), lambda i: i & 1),
+    'np_224x320x3': (functools.partial(ObEnv, (224, 320, 3)), lambda i: i & 1),
+}
+
+TRANSPORTS = {
+    'json': {'framing': 'json'},
+    'binary': {'framing': 'binary'},
+    'eventfd': {'wakeup': 'eventfd'},
+}
+
+LAYOUTS = ('process', 'thread')
+
+
+def time_steps(env, action, steps, warmup):
+    env.reset()
+    for i in range(warmup):
+        env.step(action(i))
+    latencies = []
+    start = time.perf_counter()
+    for i in range(steps):
+        t = time.perf_counter()
+        env.step(action(i))
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'steps': steps,
+        'steps_per_sec': steps / elapsed,
+        'p50_us': latencies[len(latencies) // 2] * 1e6,
+        'p99_us': latencies[int(len(latencies) * 0.99)] * 1e6,
+    }
+
+
+def run_process(make_env, action, wrapper_kwargs, steps, warmup):
+    def make_wrapper(make_env, dir, **kwargs):
+        return RemoteEnvWrapper(make_env(), dir, **kwargs)
+    wrapper = run_wrapper(make_wrapper, RemoteEnv)
+    call = next(wrapper)
+    try:
+        env = call(make_env, wrapper_kwargs=wrapper_kwargs)
+        result = time_steps(env, action, steps, warmup)
+        env.close()
+    finally:
+        # Let the generator stop the server and clean up
+        next(wrapper, None)
+    return result
+
+
+def run_thread(make_env, action, wrapper_kwargs, steps, warmup):
+    with tempfile.TemporaryDirectory() as dir:
+        server = RemoteEnvWrapper(make_env(), dir, **wrapper_kwargs)
+        thread = threading.Thread(target=server.serve, daemon=True)
+        thread.start()
+        env = RemoteEnv(dir)
+        result = time_steps(env, action, steps, warmup)
+        env.close()
+        thread.join()
+        server.close()
+    return result
+
+
+def run_suite(steps, warmup, patterns=()):
+    runners = {'process': run_process, 'thread': run_thread}
+    results = {}
+    for env_name, (make_env, action) in ENVS.items():
+        for transport, wrapper_kwargs in TRANSPORTS.items():
+            for layout in LAYOUTS:
+                name = '%s/%s/%s' % (env_name, transport, layout)
+                if patterns and not any(pattern in name for pattern in patterns):
+                    continue
+                result = runners[layout](make_env, action, wrapper_kwargs, steps, warmup)
+                results[name] = result
+                print('%-32s %10.0f steps/s %8.1f us p50 %8.1f us p99' %
+                      (name, result['steps_per_sec'], result['p50_us'], result['p99_us']))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['steps_per_sec'] < base['steps_per_sec'] * (1 - tolerance):
+            regressions.append('%s: %.0f steps/s, baseline %.0f' % (name, result['steps_per_sec'], base['steps_per_sec']))
+        if result['p50_us'] > base['p50_us'] * (1 + tolerance):
+            regressions.append('%s: %.1f us p50, baseline %.1f' % (name, result['p50_us'], base['p50_us']))
+    return regressions
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Benchmark gym_remote round trips across channel types, transports and process layouts')
+    parser.add_argument('--steps', '-n', type=int, default=5000, help='Timed steps per case')
+    parser.add_argument('--warmup', '-w', type=int, default=200, help='Untimed steps before each case')
+    parser.add_argument('--case', '-k', type=str, nargs='*', default=[], help='Only run cases whose name contains one of these')
+    parser.add_argument('--output', '-o', type=str, help='Write results to this JSON file')
+    parser.add_argument('--compare', '-c', type=str, help='Baseline JSON file to check for regressions')
+    parser.add_argument('--tolerance', '-t', type=float, default=0.2, help='Allowed fractional slowdown before a case counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.steps, args.warmup, args.case)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'time': time.time(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
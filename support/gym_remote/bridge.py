@@ -1,12 +1,123 @@
+import asyncio
+import base64
 import gym
 import gym.spaces
 import json
+import mmap
 import numpy as np
 import os
+import select
 import socket
+import struct
+import time
+import zlib
 
 gym_version = tuple(int(x) for x in gym.__version__.split('.'))
 
+# Binary frames are a payload length and message type followed by the payload
+_FRAME = struct.Struct('<IB')
+_BLOB = struct.Struct('<I')
+_MESSAGE_TYPES = ('update', 'close', 'exception')
+_MESSAGE_IDS = {type: id for id, type in enumerate(_MESSAGE_TYPES)}
+
+# Records are a mask of the channels that changed followed by one fixed
+# field per channel, in the order the channels were added
+_RECORD_CODES = {'int': 'q', 'float': 'd', 'bool': '?', 'int_fold': 'q', 'np': 'q'}
+_RECORD_CHANNELS = 64
+
+# Control blocks are a sequence number, a count of messages sent over the
+# socket and the sequence number those messages follow, followed by a record
+_CONTROL_HEADER = struct.Struct('<QQQ')
+_CONTROL_NOTICES = struct.Struct('<QQ')
+_EVENTFD_WORD = struct.Struct('=Q')
+_EVENTFD_ONE = _EVENTFD_WORD.pack(1)
+
+# File descriptors passed with the description are the eventfds followed by
+# the memfds, up to the kernel's limit for one message
+_MAX_FDS = 253
+_MFD_CLOEXEC = 1
+_MFD_HUGETLB = 4
+
+# Compressors for array payloads sent inline, by name
+_COMPRESSORS = {
+    'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+
+try:
+    import lz4.block
+    _COMPRESSORS['lz4'] = (lz4.block.compress, lz4.block.decompress)
+except ImportError:
+    pass
+
+# Delta encoded payloads start with one of these kinds
+_KEYFRAME = b'\x00'
+_DELTA = b'\x01'
+
+
+def _eventfd():
+    if hasattr(os, 'eventfd'):
+        return os.eventfd(0, os.EFD_CLOEXEC)
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, 'eventfd'):
+        raise NotImplementedError('eventfd is not available on this platform')
+    # EFD_CLOEXEC
+    fd = libc.eventfd(0, 0o2000000)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return fd
+
+
+def _memfd_create(name, flags):
+    if hasattr(os, 'memfd_create'):
+        return os.memfd_create(name, flags)
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(libc, 'memfd_create'):
+        raise NotImplementedError('memfd_create is not available on this platform')
+    fd = libc.memfd_create(name.encode('utf8'), flags)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return fd
+
+
+def _huge_page_size():
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('Hugepagesize:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 2 << 20
+
+
+def _memfd(name, size, hugetlb=False):
+    flags = _MFD_CLOEXEC
+    if hugetlb:
+        # Huge page backed files are sized in whole huge pages
+        flags |= _MFD_HUGETLB
+        page = _huge_page_size()
+        size = -(-size // page) * page
+    fd = _memfd_create(name, flags)
+    try:
+        os.ftruncate(fd, max(size, 1))
+        # Fail now rather than with SIGBUS on first touch if no huge pages are free
+        mmap.mmap(fd, 0).close()
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+def _map_fd(fd, shape, dtype):
+    # The whole file is mapped, since huge page mappings must be unmapped in
+    # whole pages
+    mapping = mmap.mmap(fd, 0)
+    return np.ndarray(shape, dtype, buffer=mapping)
+
 
 class Channel:
     def __init__(self):
@@ -92,6 +203,8 @@ class BoolChannel(Channel):
 
 class IntFoldChannel(Channel):
     TYPE = 'int_fold'
+    # Fold spaces up to this size are tabulated instead of computed per step
+    TABLE_SIZE = 1 << 16
 
     def __init__(self, folds, dtype=np.int8):
         super(IntFoldChannel, self).__init__()
@@ -99,16 +212,53 @@ class IntFoldChannel(Channel):
         self.ranges = np.array(folds, dtype=int)
         self.dtype = dtype
         self.SHAPE = str(folds) + ','
+        self._table = None
+        self._rows = None
+        self._codes = {}
+        size = int(np.prod(self.ranges))
+        if size <= self.TABLE_SIZE:
+            table = self._unfold(np.arange(size)[:, np.newaxis])
+            table.flags.writeable = False
+            self._table = table
+            # Values read from the channel are shared, read-only rows
+            self._rows = list(table)
+
+    def _fold(self, value):
+        return int(np.dot(self.folds, value % self.ranges))
+
+    def _unfold(self, value):
+        unfolded = np.full(np.shape(value)[:-1] + self.ranges.shape, value) // self.folds % self.ranges
+        return unfolded.astype(self.dtype)
+
+    def _lookup(self, value):
+        # Codes are keyed by the raw bytes of each row, once per input dtype,
+        # so that anything not exactly matching a row takes the slow path
+        codes = self._codes.get(value.dtype)
+        if codes is None:
+            rows = self._table.astype(value.dtype)
+            if np.array_equal(rows.astype(self._table.dtype), self._table):
+                codes = {row.tobytes(): code for code, row in enumerate(rows)}
+            else:
+                # The cast merges rows, so this dtype always takes the slow path
+                codes = {}
+            self._codes[value.dtype] = codes
+        return codes.get(value.tobytes())
 
     def parse(self, value):
-        folded = np.dot(self.folds, value % self.ranges)
-        return int(folded)
+        if self._rows is not None:
+            value = np.asarray(value)
+            if value.shape == self.ranges.shape:
+                code = self._lookup(value)
+                if code is not None:
+                    return code
+        return self._fold(value)
 
     def unparse(self, value):
         if value is None:
             return None
-        unfolded = np.full(self.ranges.shape, value) // self.folds % self.ranges
-        return unfolded.astype(self.dtype)
+        if self._rows is not None and 0 <= value < len(self._rows):
+            return self._rows[value]
+        return self._unfold(value)
 
     def deserialize(self, value):
         self._value = int(value)
@@ -118,14 +268,123 @@ class IntFoldChannel(Channel):
 class NpChannel(Channel):
     TYPE = 'np'
 
-    def __init__(self, shape, dtype):
+    def __init__(self, shape, dtype, slots=1, history=0):
         super(NpChannel, self).__init__()
         self.SHAPE = '%s, %s' % (shape, 'dtype("%s")' % np.dtype(dtype).str)
+        if slots > 1 or history:
+            self.SHAPE += ', %d' % slots
+        if history:
+            self.SHAPE += ', %d' % history
         self.shape = shape
         self.dtype = dtype
+        # Each write goes to the next slot, so a value read from this channel
+        # stays intact until slots - 1 further writes have been made
+        self.slots = max(slots, history)
+        self.slot = 0
+        self._slots = None
+        # With a history, every slot is also written to a mirror after the
+        # ring, so the last history values are always one contiguous view
+        self.history = history
+        self.rows = 2 * self.slots if history else self.slots
+        # Delta encoding state: the last value sent, and how many were sent
+        self._sent = None
+        self._delta = None
+        self._encoded = 0
+
+    def set_socket(self, sock):
+        super(NpChannel, self).set_socket(sock)
+        # A new connection starts from a keyframe
+        self._sent = None
+        self._encoded = 0
 
     def set_base(self, base):
-        self._value = np.memmap(base, mode='w+', dtype=self.dtype, shape=self.shape)
+        shape = (self.rows,) + tuple(self.shape)
+        if base is None:
+            # Without shared memory the value travels inline in update messages.
+            # The buffer is still a shared mapping so forked workers can fill it.
+            size = max(int(np.prod(shape)) * np.dtype(self.dtype).itemsize, 1)
+            self._slots = np.ndarray(shape, self.dtype, buffer=mmap.mmap(-1, size))
+        elif isinstance(base, int):
+            # An anonymous memfd shared over the socket
+            self._slots = _map_fd(base, shape, self.dtype)
+        else:
+            self._slots = np.memmap(base, mode='w+', dtype=self.dtype, shape=shape)
+        self.slot = 0
+        self._value = self._slots[0]
+
+    def load(self, data):
+        self.value = np.frombuffer(data, self.dtype).reshape(self.shape)
+        self.dirty = False
+
+    def encode(self, compress=None, keyframe_interval=0):
+        data = np.ascontiguousarray(self._value).reshape(-1).view(np.uint8)
+        kind = None
+        if keyframe_interval:
+            if self._sent is None or self._encoded % keyframe_interval == 0:
+                kind = _KEYFRAME
+                self._sent = data.copy()
+                self._delta = np.empty_like(data)
+            else:
+                # Consecutive frames are mostly identical, so XOR leaves mostly zeros
+                kind = _DELTA
+                np.bitwise_xor(data, self._sent, out=self._delta)
+                np.copyto(self._sent, data)
+                data = self._delta
+            self._encoded += 1
+        data = memoryview(data)
+        if compress:
+            data = compress(data)
+        if kind:
+            data = kind + data
+        return data
+
+    def decode(self, data, decompress=None, keyframe_interval=0):
+        kind = _KEYFRAME
+        if keyframe_interval:
+            data = memoryview(data)
+            kind = data[:1].tobytes()
+            data = data[1:]
+        if decompress:
+            data = decompress(data)
+        if kind == _KEYFRAME:
+            self.load(data)
+            return
+        previous = self._value.reshape(-1).view(np.uint8)
+        if self.slots > 1:
+            self.slot = (self.slot + 1) % self.slots
+            self._value = self._slots[self.slot]
+        np.bitwise_xor(previous, np.frombuffer(data, np.uint8), out=self._value.reshape(-1).view(np.uint8))
+        self._mirror()
+        self.dirty = False
+
+    def _mirror(self):
+        if self.history:
+            np.copyto(self._slots[self.slot + self.slots], self._value)
+
+    def history_view(self):
+        # The last history values, oldest first, without copying
+        end = self.slot + self.slots + 1
+        return self._slots[end - self.history:end]
+
+    def claim(self):
+        # Move to the next slot without writing it, so that it can be filled
+        # in place, and return its index. Call commit once it is filled.
+        if self.slots > 1:
+            self.slot = (self.slot + 1) % self.slots
+            self._value = self._slots[self.slot]
+        self.dirty = True
+        return self.slot
+
+    def commit(self):
+        self._mirror()
+
+    def slot_value(self, slot):
+        return self._slots[slot]
+
+    def fill_history(self):
+        # Make every value in the history the current one, as at the start of
+        # an episode
+        self._slots[:] = self._value
 
     @property
     def value(self):
@@ -133,26 +392,141 @@ class NpChannel(Channel):
 
     @value.setter
     def value(self, value):
+        if self.slots > 1:
+            self.slot = (self.slot + 1) % self.slots
+            self._value = self._slots[self.slot]
         np.copyto(self._value, value)
+        self._mirror()
         self.dirty = True
 
     def serialize(self):
+        if self.slots > 1:
+            return self.slot
         return True
 
     def deserialize(self, value):
+        if self.slots > 1:
+            self.slot = int(value)
+            self._value = self._slots[self.slot]
         self.dirty = False
 
 
+class Stats:
+    # Latencies are kept in power of two microsecond buckets, so recording one
+    # costs a bit_length instead of storing every sample
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0, 0.0, [0] * self.BUCKETS]
+        timer[0] += 1
+        timer[1] += seconds
+        timer[2][min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)] += 1
+
+    def percentile(self, name, q):
+        count, _, buckets = self.timers[name]
+        rank = q * count
+        seen = 0
+        for bucket, n in enumerate(buckets):
+            seen += n
+            if n and seen >= rank:
+                # Report the upper bound of the bucket
+                return (1 << bucket) / 1e6
+        return None
+
+    def to_dict(self):
+        timers = {}
+        for name, (count, total, buckets) in self.timers.items():
+            timers[name] = {
+                'count': count,
+                'total': total,
+                'mean': total / count,
+                'p50': self.percentile(name, 0.5),
+                'p99': self.percentile(name, 0.99),
+                # Bucket i counts samples under 2 ** i microseconds
+                'buckets': buckets,
+            }
+        return {'counters': dict(self.counters), 'timers': timers}
+
+
 class Bridge:
     Timeout = socket.timeout
     Closed = BrokenPipeError
 
-    def __init__(self, base):
+    FRAMINGS = ('json', 'binary')
+    WAKEUPS = ('socket', 'eventfd')
+    COMPRESSIONS = tuple(_COMPRESSORS)
+    MEMORIES = ('file', 'memfd', 'hugetlb')
+    BUFFER_SIZE = 4096
+
+    def __init__(self, base, framing='json', wakeup='socket', spin_us=0, compression=None, keyframe_interval=0,
+                 memory='file', instrument=False, stats_path=None, namespace=None):
+        if framing not in self.FRAMINGS:
+            raise ValueError('Unknown framing: %s' % framing)
+        if wakeup not in self.WAKEUPS:
+            raise ValueError('Unknown wakeup: %s' % wakeup)
+        if compression is not None and compression not in self.COMPRESSIONS:
+            raise ValueError('Unknown compression: %s' % compression)
+        if memory not in self.MEMORIES:
+            raise ValueError('Unknown memory: %s' % memory)
+        # A base of tcp://host:port connects over the network instead of a
+        # socket directory, and sends arrays inline instead of sharing files
+        self.address = None
+        if base.startswith('tcp://'):
+            host, port = base[len('tcp://'):].rsplit(':', 1)
+            self.address = (host, int(port))
+            if wakeup != 'socket':
+                raise ValueError('TCP bridges only support the socket wakeup')
+            if memory != 'file':
+                raise ValueError('TCP bridges do not share memory')
         self.base = base
-        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Servers with several clients keep each one's files in a namespace
+        # directory under the base, which the client learns from the description
+        self.namespace = namespace
+        if namespace and not self.address:
+            os.makedirs(os.path.join(base, namespace), exist_ok=True)
+        self._listening = False
+        self.compression = compression
+        # Inline arrays are sent as deltas, with a full frame every keyframe_interval
+        self.keyframe_interval = keyframe_interval
+        self.framing = framing
+        self.wakeup = wakeup
+        # Shared memory is either files in the socket directory or anonymous
+        # memfds, which are passed to the client over the socket
+        self.memory = memory
+        self._memfds = {}
+        # Instrumented bridges record counters and latencies, and write them
+        # to stats_path as JSON when closed
+        self.stats_path = stats_path
+        self._stats = Stats() if instrument or stats_path else None
+        # Servers with a request handler wait for the client to send a request
+        # before describing their channels, so the handler can add channels
+        self.request_handler = None
+        # Persistent servers only drop a client that closes, and keep
+        # listening for the next one
+        self.persistent = False
+        # Receivers using a control block can spin on it before blocking
+        self.spin_us = spin_us
+        self.spin_hits = 0
+        self.spin_misses = 0
+        if self.address:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 
         def close(message):
-            self.close()
+            if self.persistent:
+                self.disconnect()
+            else:
+                self.close()
             if 'exception' in message:
                 import gym_remote.exceptions as gre
                 exception = gre.make(message['exception'], message['reason'])
@@ -165,10 +539,33 @@ class Bridge:
             raise gre.make(message['exception'], message['reason'])
 
         self._channels = {}
+        self._channel_names = []
+        self._channel_ids = {}
+        self._channel_list = []
+        self._record = None
         self.connection = None
-        self._buffer = []
+        self._timeout = None
+        # With eventfd wakeups, updates go through a shared control block and
+        # the socket only carries the handshake, closes and exceptions
+        self._control = None
+        self._control_in = None
+        self._control_out = None
+        self._control_seq = 0
+        self._control_seen = 0
+        self._notices_in = 0
+        self._notices_out = 0
+        self._notice_seq = 0
+        self._signal_in = None
+        self._signal_out = None
+        self._poll = None
+        # Received bytes live in _buffer[_start:_end] until a whole message is parsed
+        self._buffer = bytearray(self.BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
         self._message_handlers = {
             'update': self.update_vars,
+            'record': self.update_record,
             'close': close,
             'exception': exception
         }
@@ -180,10 +577,32 @@ class Bridge:
         if name in self._channels:
             raise KeyError(name)
         self._channels[name] = channel
-        channel.set_base(os.path.join(self.base, name))
+        self._index_channel(name)
+        if self.memory != 'file' and channel.TYPE == 'np':
+            size = channel.rows * int(np.prod(channel.shape)) * np.dtype(channel.dtype).itemsize
+            self._memfds[name] = _memfd(name, size, self.memory == 'hugetlb')
+            channel.set_base(self._memfds[name])
+        else:
+            channel.set_base(self._channel_base(name))
         return channel
 
-    def wrap(self, name, space):
+    def _channel_base(self, name):
+        if self.address:
+            return None
+        if self.namespace:
+            return os.path.join(self.base, self.namespace, name)
+        return os.path.join(self.base, name)
+
+    def _close_memfds(self):
+        for fd in self._memfds.values():
+            os.close(fd)
+        self._memfds = {}
+
+    def _index_channel(self, name):
+        self._channel_ids[name] = len(self._channel_names)
+        self._channel_names.append(name)
+
+    def wrap(self, name, space, slots=1, history=0):
         channel = None
         if isinstance(space, gym.spaces.MultiBinary):
             if space.n < 64:
@@ -205,66 +624,251 @@ class Bridge:
                 channel.annotate('shape', space.shape)
             channel.annotate('type', 'MultiDiscrete')
         elif isinstance(space, gym.spaces.Box):
-            channel = NpChannel(space.shape, space.high.dtype)
+            channel = NpChannel(space.shape, space.high.dtype, slots, history)
+            channel.annotate('type', 'Box')
+            channel.annotate('shape', space.shape)
+
+        if not channel:
+            raise NotImplementedError('Unsupported space')
+
+        return self.add_channel(name, channel)
+
+    def wrap_batch(self, name, space, n, slots=1):
+        channel = None
+        if isinstance(space, gym.spaces.MultiBinary):
+            channel = NpChannel((n, space.n), np.uint8)
+            channel.annotate('n', space.n)
+            channel.annotate('type', 'MultiBinary')
+        elif isinstance(space, gym.spaces.Discrete):
+            channel = NpChannel((n,), np.int64)
+            channel.annotate('n', space.n)
+            channel.annotate('type', 'Discrete')
+        elif isinstance(space, gym.spaces.MultiDiscrete):
+            if gym_version >= (0, 9, 6):
+                channel = NpChannel((n,) + tuple(space.shape), np.int64)
+                channel.annotate('shape', space.shape[0])
+            else:
+                channel = NpChannel((n, space.shape), np.int64)
+                channel.annotate('shape', space.shape)
+            channel.annotate('type', 'MultiDiscrete')
+        elif isinstance(space, gym.spaces.Box):
+            channel = NpChannel((n,) + tuple(space.shape), space.high.dtype, slots)
             channel.annotate('type', 'Box')
             channel.annotate('shape', space.shape)
 
         if not channel:
             raise NotImplementedError('Unsupported space')
 
+        channel.annotate('batch', n)
         return self.add_channel(name, channel)
 
     @staticmethod
     def unwrap(space):
+        shape = getattr(space, 'shape', None)
+        if 'batch' in space.annotations:
+            # Batched channels stack one value per environment
+            shape = tuple(shape[1:])
         if space.annotations['type'] == 'MultiBinary':
             return gym.spaces.MultiBinary(int(space.annotations['n']))
         if space.annotations['type'] == 'Discrete':
             return gym.spaces.Discrete(int(space.annotations['n']))
         if space.annotations['type'] == 'MultiDiscrete':
             if gym_version >= (0, 9, 6):
-                return gym.spaces.MultiDiscrete(space.shape[0])
+                return gym.spaces.MultiDiscrete(shape[0])
             else:
-                return gym.spaces.MultiDiscrete(space.shape)
+                return gym.spaces.MultiDiscrete(shape)
         if space.annotations['type'] == 'Box':
             kwargs = {}
             if gym_version >= (0, 9, 6):
                 kwargs['dtype'] = space.dtype
-            return gym.spaces.Box(low=0, high=255, shape=space.shape, **kwargs)
+            return gym.spaces.Box(low=0, high=255, shape=shape, **kwargs)
 
     def configure_channels(self, channel_info):
         for name, info in channel_info.items():
             self._channels[name] = Channel.make(*info)
+            self._index_channel(name)
+        self._compile_record()
 
     def describe_channels(self):
         description = {}
         for name, channel in self._channels.items():
             description[name] = (channel.TYPE, channel.SHAPE, channel.annotations)
+        self._compile_record()
         return description
 
-    def listen(self):
-        sock_path = os.path.join(self.base, 'sock')
-        self.sock.bind(sock_path)
-        self.sock.listen(1)
+    def _compile_record(self):
+        # Both sides see the channels in the same order, so each one gets the
+        # same offset in the packed record
+        self._channel_list = [self._channels[name] for name in self._channel_names]
+        if len(self._channel_list) > _RECORD_CHANNELS:
+            self._record = None
+            return
+        codes = ''.join(_RECORD_CODES[channel.TYPE] for channel in self._channel_list)
+        self._record = struct.Struct('<Q' + codes)
+
+    def _check_record(self):
+        if self._record is None:
+            raise ValueError('Packed records hold at most %d channels' % _RECORD_CHANNELS)
+
+    def _pack_record(self, buffer=None, offset=0):
+        mask = 0
+        values = []
+        blobs = []
+        for i, channel in enumerate(self._channel_list):
+            if channel.dirty:
+                mask |= 1 << i
+                values.append(channel.serialize())
+                if self.address and channel.TYPE == 'np':
+                    # Inline arrays follow the record in channel order
+                    data = self._encode_array(channel)
+                    blobs.append(_BLOB.pack(len(data)))
+                    blobs.append(data)
+            else:
+                values.append(0)
+        if buffer is not None:
+            self._record.pack_into(buffer, offset, mask, *values)
+            return None
+        return b''.join([self._record.pack(mask, *values)] + blobs)
+
+    def _unpack_record(self, payload, offset=0):
+        values = self._record.unpack_from(payload, offset)
+        self._apply_record(values, payload, offset + self._record.size)
+
+    def _apply_record(self, values, payload=None, offset=0):
+        mask = values[0]
+        i = 0
+        while mask:
+            if mask & 1:
+                channel = self._channel_list[i]
+                if self.address and channel.TYPE == 'np':
+                    size, = _BLOB.unpack_from(payload, offset)
+                    offset += _BLOB.size
+                    self._decode_array(channel, memoryview(payload)[offset:offset + size])
+                    offset += size
+                else:
+                    channel.deserialize(values[i + 1])
+            mask >>= 1
+            i += 1
+
+    def _sock_address(self):
+        if self.address:
+            return self.address
+        return os.path.join(self.base, 'sock')
+
+    def listen(self, backlog=1):
+        if self.address:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self._sock_address())
+        self.sock.listen(backlog)
+        self._listening = True
+        if self.address:
+            # Binding to port 0 picks a free port
+            self.address = self.sock.getsockname()[:2]
 
     def connect(self):
-        sock_path = os.path.join(self.base, 'sock')
-        self.sock.connect(sock_path)
+        self.sock.connect(self._sock_address())
         self.connection = self.sock
+        self._set_nodelay()
+
+    def _set_nodelay(self):
+        if self.address:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     def server_accept(self):
-        self.connection, _ = self.sock.accept()
+        connection, _ = self.sock.accept()
+        self.adopt(connection)
+
+    def adopt(self, connection):
+        # Serve a client accepted on another socket, such as a shared listener
+        self.connection = connection
+        start = time.perf_counter()
+        self._set_nodelay()
+        extra = {}
+        if self.request_handler:
+            extra.update(self._handle_request())
         for name, channel in self._channels.items():
             channel.set_socket(self.connection)
         description = self.describe_channels()
-        self._send_message('description', description)
+        extra['framing'] = self.framing
+        if self.compression:
+            extra['compression'] = self.compression
+        if self.keyframe_interval:
+            extra['keyframe_interval'] = self.keyframe_interval
+        if self.namespace:
+            extra['namespace'] = self.namespace
+        fds = []
+        if self.wakeup == 'eventfd':
+            # The eventfds ride along with the description as ancillary data
+            signals = [_eventfd(), _eventfd()]
+            if self.memory != 'file':
+                self._memfds['ctl'] = _memfd('ctl', 2 * self._control_size(), self.memory == 'hugetlb')
+            self._open_control(0, *signals)
+            extra['wakeup'] = self.wakeup
+            fds.extend(signals)
+        if self._memfds:
+            extra['memfds'] = list(self._memfds)
+            fds.extend(self._memfds.values())
+        self._send_json('description', description, fds=fds, **extra)
+        if self._stats is not None:
+            self._stats.time('handshake', time.perf_counter() - start)
+
+    def _handle_request(self):
+        self._send_json('hello', {})
+        request = self._recv(self._parse_json)
+        if request['type'] != 'request':
+            raise self.Closed('Expected a request, not %s' % request['type'])
+        try:
+            return self.request_handler(request['content']) or {}
+        except ValueError as e:
+            import gym_remote.exceptions as gre
+            # The client is still reading JSON, whatever the framing
+            self._send_json('close', {'reason': str(e), 'exception': gre.RequestError.ID})
+            self.disconnect()
+            raise gre.RequestError(str(e))
 
-    def configure_client(self):
-        description = self._recv_message()
+    def configure_client(self, request=None):
+        if not self.connection:
+            raise self.Closed
+        start = time.perf_counter()
+        fds = self._fill(fds=_MAX_FDS)
+        description = self._recv(self._parse_json)
+        if description['type'] == 'hello':
+            # The server wants to hear what the client needs first
+            self._send_json('request', request or {})
+            fds = self._fill(fds=_MAX_FDS)
+            description = self._recv(self._parse_json)
+        if description['type'] == 'close':
+            self._message_handlers['close'](description['content'])
+        channels = self._configure(description, fds)
+        if self._stats is not None:
+            self._stats.time('handshake', time.perf_counter() - start)
+        return channels
+
+    def _configure(self, description, fds):
         assert description['type'] == 'description'
         self.configure_channels(description['content'])
+        # Older servers do not announce a framing and only speak JSON
+        self.framing = description.get('framing', 'json')
+        self.wakeup = description.get('wakeup', 'socket')
+        self.compression = description.get('compression')
+        self.keyframe_interval = description.get('keyframe_interval', 0)
+        self.namespace = description.get('namespace')
+        if self.wakeup == 'eventfd':
+            signal_out, signal_in = fds[:2]
+            fds = fds[2:]
+        memfds = dict(zip(description.get('memfds', []), fds))
+        if memfds:
+            self.memory = 'memfd'
+        self._memfds = memfds
+        if self.wakeup == 'eventfd':
+            self._open_control(1, signal_in, signal_out)
+        for fd in fds[len(memfds):]:
+            os.close(fd)
         for name, channel in self._channels.items():
             channel.set_socket(self.connection)
-            channel.set_base(os.path.join(self.base, name))
+            channel.set_base(memfds.get(name, self._channel_base(name)))
+        # The mappings keep the memory alive without the descriptors
+        self._close_memfds()
         return dict(self._channels)
 
     def _try_send(self, type, content):
@@ -276,55 +880,408 @@ class Bridge:
                     self.recv()
             except self.Closed as f:
                 e = f
-            self.close()
+            if self.persistent:
+                self.disconnect()
+            else:
+                self.close()
             raise e
 
     def _send_message(self, type, content):
         if not self.connection:
             raise self.Closed
+        message = self._encode_message(type, content)
+        try:
+            self.connection.sendall(message)
+        except ConnectionResetError as e:
+            # TCP peers that go away reset the connection instead
+            raise self.Closed(*e.args)
+        if self._stats is not None:
+            self._count_sent(type, len(message))
+        if self._control is not None:
+            self._notify()
+
+    def _count_sent(self, type, size):
+        self._stats.count('sent.' + type)
+        self._stats.count('bytes_sent', size)
+
+    def _count_received(self, type, size=0):
+        self._stats.count('received.' + type)
+        if size:
+            self._stats.count('bytes_received', size)
+
+    def _handle_message(self, message):
+        type = message['type']
+        if self._stats is not None:
+            # Binary updates are handled as records
+            self._count_received('update' if type == 'record' else type)
+        self._message_handlers[type](message['content'])
+
+    def _recv_message(self):
+        return self._recv(self._parse_message)
+
+    def _encode_message(self, type, content):
+        if self.framing == 'binary':
+            return self._encode_binary(type, content)
+        return self._encode_json(type, content)
+
+    def _parse_message(self):
+        if self.framing == 'binary':
+            return self._parse_binary()
+        return self._parse_json()
+
+    def _send_json(self, type, content, fds=None, **extra):
+        if not self.connection:
+            raise self.Closed
+        message = self._encode_json(type, content, **extra)
+        if self._stats is not None:
+            self._count_sent(type, len(message))
+        if fds:
+            import array
+            ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))]
+            sent = self.connection.sendmsg([message], ancillary)
+            message = message[sent:]
+        self.connection.sendall(message)
+
+    def _encode_json(self, type, content, **extra):
         message = {
             'type': type,
             'content': content
         }
+        message.update(extra)
         # All messages end in a form feed
-        message = json.dumps(message) + '\f'
-        self.connection.sendall(message.encode('utf8'))
+        return (json.dumps(message) + '\f').encode('utf8')
 
-    def _recv_message(self):
+    def _parse_json(self):
+        end = self._buffer.find(b'\f', self._start, self._end)
+        if end < 0:
+            # There are no fully buffered messages
+            return None
+        message = json.loads(str(self._view[self._start:end], 'utf8'))
+        self._consume(end + 1)
+        return message
+
+    def _recv(self, parse):
         if not self.connection:
             raise self.Closed
-        while len(self._buffer) < 2:
-            # There are no fully buffered messages
-            message = self.connection.recv(4096)
-            if not message:
-                raise self.Closed
-            message = message.split(b'\f')
-            if self._buffer:
-                self._buffer[-1] += message.pop(0)
-            self._buffer.extend(message)
-        message = self._buffer.pop(0)
-        return json.loads(message.decode('utf8'))
+        message = parse()
+        while message is None:
+            self._fill()
+            message = parse()
+        return message
+
+    def _reserve(self):
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            pending = self._end - self._start
+            if pending > self._start:
+                # Moving the pending bytes would overlap, so make room instead
+                buffer = bytearray(2 * len(self._buffer))
+                buffer[:pending] = self._view[self._start:self._end]
+                self._buffer = buffer
+                self._view = memoryview(buffer)
+            else:
+                self._view[:pending] = self._view[self._start:self._end]
+            self._start = 0
+            self._end = pending
+        return self._view[self._end:]
+
+    def _fill(self, fds=0):
+        if self._stats is not None:
+            start = time.perf_counter()
+        if fds:
+            received, received_fds = self._recv_fds(fds)
+        else:
+            try:
+                received = self.connection.recv_into(self._reserve())
+            except ConnectionResetError:
+                received = 0
+        if self._stats is not None:
+            self._stats.time('blocked', time.perf_counter() - start)
+            self._stats.count('bytes_received', received)
+        if not received:
+            raise self.Closed
+        self._end += received
+        if fds:
+            return received_fds
+
+    def _recv_fds(self, count):
+        import array
+        fds = array.array('i')
+        size = socket.CMSG_SPACE(count * fds.itemsize)
+        received, ancillary, _, _ = self.connection.recvmsg_into([self._reserve()], size)
+        for level, type, data in ancillary:
+            if level == socket.SOL_SOCKET and type == socket.SCM_RIGHTS:
+                fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+        return received, list(fds)
+
+    def _consume(self, end):
+        self._start = end
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _encode_binary(self, type, content):
+        if type == 'update':
+            # Updates arrive already packed into a record
+            payload = content
+        else:
+            payload = json.dumps(content).encode('utf8')
+        return _FRAME.pack(len(payload), _MESSAGE_IDS[type]) + payload
+
+    def _parse_binary(self):
+        start = self._start + _FRAME.size
+        if self._end < start:
+            return None
+        size, type = _FRAME.unpack_from(self._buffer, self._start)
+        end = start + size
+        if self._end < end:
+            return None
+        type = _MESSAGE_TYPES[type]
+        if type == 'update':
+            # The record is unpacked by its handler, before the buffer is refilled
+            type = 'record'
+            content = start
+        else:
+            content = json.loads(str(self._view[start:end], 'utf8'))
+        self._consume(end)
+        return {'type': type, 'content': content}
+
+    def _open_control(self, side, signal_in, signal_out):
+        self._check_record()
+        shape = (2, self._control_size())
+        if 'ctl' in self._memfds:
+            self._control = _map_fd(self._memfds['ctl'], shape, np.uint8)
+        else:
+            mode = 'r+' if side else 'w+'
+            self._control = np.memmap(self._channel_base('ctl'), mode=mode, dtype=np.uint8, shape=shape)
+        # Each side writes its own row and reads the other one
+        self._control_out = self._control[side].data
+        self._control_in = self._control[1 - side].data
+        self._control_seq = 0
+        self._control_seen = 0
+        self._notices_in = 0
+        self._notices_out = 0
+        self._notice_seq = 0
+        self._signal_in = signal_in
+        self._signal_out = signal_out
+        self._poll = select.poll()
+        self._poll.register(self.connection, select.POLLIN)
+        self._poll.register(signal_in, select.POLLIN)
+
+    def _control_size(self):
+        self._check_record()
+        return _CONTROL_HEADER.size + self._record.size
+
+    def _close_control(self):
+        for fd in (self._signal_in, self._signal_out):
+            if fd is not None:
+                os.close(fd)
+        self._signal_in = None
+        self._signal_out = None
+        self._poll = None
+        self._control = None
+        self._control_in = None
+        self._control_out = None
+
+    def _write_control(self):
+        # An odd sequence number marks the record as being written
+        self._control_seq += 2
+        _CONTROL_HEADER.pack_into(self._control_out, 0, self._control_seq - 1, self._notices_out, self._notice_seq)
+        self._pack_record(self._control_out, _CONTROL_HEADER.size)
+        _CONTROL_HEADER.pack_into(self._control_out, 0, self._control_seq, self._notices_out, self._notice_seq)
+        os.write(self._signal_out, _EVENTFD_ONE)
+        if self._stats is not None:
+            self._count_sent('update', self._record.size)
+
+    def _notify(self):
+        # Tell the peer that a message is waiting on the socket, so that it is
+        # handled before any update written to the control block after it
+        self._notices_out += 1
+        self._notice_seq = self._control_seq
+        _CONTROL_NOTICES.pack_into(self._control_out, 8, self._notices_out, self._notice_seq)
+
+    def _read_control(self):
+        while True:
+            seq, _, _ = _CONTROL_HEADER.unpack_from(self._control_in)
+            values = self._record.unpack_from(self._control_in, _CONTROL_HEADER.size)
+            check, _, _ = _CONTROL_HEADER.unpack_from(self._control_in)
+            if not seq & 1 and seq == check and seq > self._control_seen:
+                break
+        self._control_seen = seq
+        if self._stats is not None:
+            self._count_received('update', self._record.size)
+        self._apply_record(values)
+
+    def _recv_notice(self):
+        self._notices_in += 1
+        self._handle_message(self._recv_message())
+
+    def _pending_control(self):
+        seq, notices, notice_seq = _CONTROL_HEADER.unpack_from(self._control_in)
+        if self._start != self._end:
+            return self._recv_notice
+        # Socket messages are handled after the updates that were sent before them
+        if notices > self._notices_in and notice_seq <= self._control_seen:
+            return self._recv_notice
+        # Updates that arrive together are coalesced into the latest record
+        if seq > self._control_seen or notices > self._notices_in:
+            return self._read_control
+        return None
+
+    def _recv_control(self):
+        if self._stats is not None:
+            start = time.perf_counter()
+        pending = self._pending_control()
+        if self.spin_us:
+            end = time.perf_counter() + self.spin_us / 1e6
+            while not pending and time.perf_counter() < end:
+                pending = self._pending_control()
+            if pending:
+                self.spin_hits += 1
+            else:
+                self.spin_misses += 1
+        timeout = None if self._timeout is None else int(self._timeout * 1000)
+        while not pending:
+            ready = dict(self._poll.poll(timeout))
+            if not ready:
+                raise self.Timeout
+            if self._signal_in in ready:
+                os.read(self._signal_in, _EVENTFD_WORD.size)
+            pending = self._pending_control()
+            if not pending and self.connection.fileno() in ready:
+                # The peer went away, or its notice is not visible yet
+                pending = self._recv_notice
+        if self._stats is not None:
+            self._stats.time('blocked', time.perf_counter() - start)
+        pending()
+        return True
+
+    @property
+    def spin_hit_ratio(self):
+        total = self.spin_hits + self.spin_misses
+        if not total:
+            return None
+        return self.spin_hits / total
 
     def update_vars(self, vars):
         for name, value in vars.items():
-            self._channels[name].deserialize(value)
+            channel = self._channels[name]
+            if self.address and isinstance(channel, NpChannel):
+                self._decode_array(channel, value)
+            else:
+                channel.deserialize(value)
+
+    def update_record(self, offset):
+        self._unpack_record(self._buffer, offset)
+
+    def _encode_array(self, channel):
+        compress = None
+        if self.compression:
+            compress = _COMPRESSORS[self.compression][0]
+        data = channel.encode(compress, self.keyframe_interval)
+        if self.framing == 'json':
+            return base64.b64encode(data).decode('ascii')
+        return data
+
+    def _decode_array(self, channel, data):
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        decompress = None
+        if self.compression:
+            decompress = _COMPRESSORS[self.compression][1]
+        channel.decode(data, decompress, self.keyframe_interval)
 
     def send(self):
+        if self._stats is not None:
+            start = time.perf_counter()
+        if self._control is not None:
+            if not self.connection:
+                raise self.Closed
+            self._write_control()
+        else:
+            self._try_send('update', self._update_content())
+        if self._stats is not None:
+            self._stats.time('send', time.perf_counter() - start)
+
+    def _update_content(self):
+        if self.framing == 'binary':
+            self._check_record()
+            return self._pack_record()
         content = {}
         for name, channel in self._channels.items():
             if channel.dirty:
-                content[name] = channel.serialize()
-        self._try_send('update', content)
+                if self.address and isinstance(channel, NpChannel):
+                    content[name] = self._encode_array(channel)
+                else:
+                    content[name] = channel.serialize()
+        return content
 
     def recv(self):
-        message = self._recv_message()
-        if not message:
+        if self._stats is not None:
+            start = time.perf_counter()
+        if self._control is not None:
+            self._recv_control()
+        else:
+            message = self._recv_message()
+            if not message:
+                raise self.Closed
+            self._handle_message(message)
+        if self._stats is not None:
+            self._stats.time('recv', time.perf_counter() - start)
+        return True
+
+    def try_recv(self):
+        # Handle one message if that can be done without blocking, for servers
+        # that wait on many bridges with a selector
+        if not self.connection:
             raise self.Closed
-        self._message_handlers[message['type']](message['content'])
+        if self._control is not None:
+            pending = self._pending_control()
+            if not pending:
+                ready = dict(self._poll.poll(0))
+                if self._signal_in in ready:
+                    os.read(self._signal_in, _EVENTFD_WORD.size)
+                    pending = self._pending_control()
+                if not pending and self.connection.fileno() in ready:
+                    pending = self._recv_notice
+            if not pending:
+                return False
+            pending()
+            return True
+        message = self._parse_message()
+        if message is None:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            if not readable:
+                return False
+            self._fill()
+            message = self._parse_message()
+            if message is None:
+                return False
+        self._handle_message(message)
         return True
 
+    def selectables(self):
+        # What a selector should wait on for the next message
+        if self._control is not None:
+            return [self.connection.fileno(), self._signal_in]
+        return [self.connection.fileno()]
+
+    def stats(self):
+        if self._stats is None:
+            return None
+        stats = self._stats.to_dict()
+        stats['counters']['spin_hits'] = self.spin_hits
+        stats['counters']['spin_misses'] = self.spin_misses
+        return stats
+
+    def _dump_stats(self):
+        if self.stats_path:
+            with open(self.stats_path, 'w') as f:
+                json.dump(self.stats(), f, indent=2, sort_keys=True)
+
     def close(self, reason=None, exception=None):
         if self.sock:
+            self._dump_stats()
             try:
                 kwargs = {'reason': reason}
                 if exception:
@@ -336,15 +1293,47 @@ class Bridge:
         if self.sock and self.connection != self.sock:
             if self.connection:
                 self.connection.close()
-            try:
-                os.unlink(os.path.join(self.base, 'sock'))
-            except OSError:
-                pass
-            for name, channel in self._channels.items():
-                try:
-                    os.unlink(os.path.join(self.base, name))
-                except OSError:
-                    pass
+            if not self.address:
+                if self._listening:
+                    try:
+                        os.unlink(os.path.join(self.base, 'sock'))
+                    except OSError:
+                        pass
+                for name in list(self._channels.keys()) + ['ctl']:
+                    try:
+                        os.unlink(self._channel_base(name))
+                    except OSError:
+                        pass
+                if self.namespace:
+                    try:
+                        os.rmdir(os.path.join(self.base, self.namespace))
+                    except OSError:
+                        pass
+        self._close_control()
+        self._close_memfds()
+        self.connection = None
+        self.sock = None
+
+    def disconnect(self):
+        # Drop the client but keep listening, with the same channels, so that
+        # another client can be accepted
+        if self.connection and self.connection != self.sock:
+            self.connection.close()
+        self.connection = None
+        self._close_control()
+        if 'ctl' in self._memfds:
+            os.close(self._memfds.pop('ctl'))
+        self._start = self._end = 0
+
+    def detach(self):
+        # Let go of the sockets and descriptors without telling the other side
+        # or removing any files, as in a forked child that no longer serves
+        if self.connection and self.connection != self.sock:
+            self.connection.close()
+        if self.sock:
+            self.sock.close()
+        self._close_control()
+        self._close_memfds()
         self.connection = None
         self.sock = None
 
@@ -353,9 +1342,100 @@ class Bridge:
         self._try_send('exception', content)
 
     def settimeout(self, timeout):
+        self._timeout = timeout
         self.sock.settimeout(timeout)
         if self.connection:
             self.connection.settimeout(timeout)
 
     def __del__(self):
-        self.close()
+        # Bridges with invalid arguments fail before they have a socket to close
+        if hasattr(self, 'sock'):
+            self.close()
+
+
+# Client side of a Bridge driven by an asyncio event loop. Only the socket
+# wakeup is supported, since control blocks would need the loop to watch the
+# eventfd as well.
+class AsyncBridge(Bridge):
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        self.sock.setblocking(False)
+        await loop.sock_connect(self.sock, self._sock_address())
+        self.connection = self.sock
+        self._set_nodelay()
+
+    async def configure_client(self, request=None):
+        description = await self._recv_async(self._parse_json)
+        if description['type'] == 'hello':
+            await self._try_send_async('request', request or {})
+            description = await self._recv_async(self._parse_json)
+        if description['type'] == 'close':
+            self._message_handlers['close'](description['content'])
+        if description.get('wakeup', 'socket') != 'socket':
+            raise NotImplementedError('AsyncBridge only supports the socket wakeup')
+        if description.get('memfds'):
+            raise NotImplementedError('AsyncBridge only supports file backed memory')
+        return self._configure(description, [])
+
+    async def send(self):
+        await self._try_send_async('update', self._update_content())
+
+    async def recv(self):
+        message = await self._recv_async(self._parse_message)
+        self._handle_message(message)
+        return True
+
+    async def exception(self, exception, reason=None):
+        content = {'reason': reason, 'exception': exception.ID}
+        await self._try_send_async('exception', content)
+
+    async def _try_send_async(self, type, content):
+        if not self.connection:
+            raise self.Closed
+        loop = asyncio.get_running_loop()
+        try:
+            message = self._encode_message(type, content)
+            await loop.sock_sendall(self.connection, message)
+            if self._stats is not None:
+                self._count_sent(type, len(message))
+        except self.Closed as e:
+            try:
+                while True:
+                    await self.recv()
+            except self.Closed as f:
+                e = f
+            if self.persistent:
+                self.disconnect()
+            else:
+                self.close()
+            raise e
+
+    async def _recv_async(self, parse):
+        if not self.connection:
+            raise self.Closed
+        loop = asyncio.get_running_loop()
+        message = parse()
+        while message is None:
+            buffer = self._reserve()
+            if hasattr(loop, 'sock_recv_into'):
+                received = await loop.sock_recv_into(self.connection, buffer)
+            else:
+                data = await loop.sock_recv(self.connection, len(buffer))
+                received = len(data)
+                buffer[:received] = data
+            if self._stats is not None:
+                self._stats.count('bytes_received', received)
+            if not received:
+                raise self.Closed
+            self._end += received
+            message = parse()
+        return message
+
+    def close(self, reason=None, exception=None):
+        # The final close message is sent synchronously
+        if self.sock:
+            self.sock.setblocking(True)
+        super(AsyncBridge, self).close(reason, exception)
+
+    def settimeout(self, timeout):
+        raise NotImplementedError('Use asyncio.wait_for to bound AsyncBridge calls')
@@ -1,12 +1,18 @@
+import asyncio
 import gym
+import numpy as np
+import os
 import time
 
-from gym_remote import Bridge
+from gym_remote import AsyncBridge, Bridge
+from gym_remote.preprocess import Preprocessor
 
 
 class RemoteEnv(gym.Env):
-    def __init__(self, directory, tries=8):
-        self.bridge = Bridge(directory)
+    def __init__(self, directory, tries=8, preprocess=None, **bridge_kwargs):
+        self.bridge = Bridge(directory, **bridge_kwargs)
+        self.bridge_kwargs = bridge_kwargs
+        self.preprocess = preprocess
 
         # Try a few times to connect
         backoff = 2
@@ -14,32 +20,226 @@ class RemoteEnv(gym.Env):
             try:
                 self.bridge.connect()
                 break
-            except FileNotFoundError:
+            except (FileNotFoundError, ConnectionRefusedError):
                 if x + 1 == tries:
                     raise
                 time.sleep(backoff)
                 backoff *= 2
 
-        self.bridge.configure_client()
+        self.bridge.configure_client({'preprocess': preprocess} if preprocess else None)
         self.ch_ac = self.bridge._channels['ac']
         self.ch_ob = self.bridge._channels['ob']
         self.ch_reward = self.bridge._channels['reward']
         self.ch_done = self.bridge._channels['done']
         self.ch_reset = self.bridge._channels['reset']
+        # Servers started with max_sequence can run several actions per step
+        self.ch_seq = self.bridge._channels.get('ac_seq')
+        if self.ch_seq is not None:
+            self.ch_seq_len = self.bridge._channels['seq_len']
+            self.ch_seq_steps = self.bridge._channels['seq_steps']
+            self.ch_seq_rewards = self.bridge._channels['seq_rewards']
+        # Servers started with max_states can save and restore env states
+        self.ch_save = self.bridge._channels.get('save_state')
+        if self.ch_save is not None:
+            self.ch_restore = self.bridge._channels['restore_state']
+            self.ch_state = self.bridge._channels['state']
+        # Servers started with max_forks can fork copies of themselves
+        self.ch_fork = self.bridge._channels.get('fork')
+        if self.ch_fork is not None:
+            self.ch_fork_pids = self.bridge._channels['fork_pids']
         self.action_space = self.bridge.unwrap(self.ch_ac)
         self.observation_space = self.bridge.unwrap(self.ch_ob)
+        # Servers that cannot preprocess send full observations, which are then
+        # preprocessed here instead
+        self.preprocessor = None
+        if preprocess and 'preprocess' not in self.ch_ob.annotations:
+            self.preprocessor = Preprocessor(preprocess, self.observation_space)
+            self.observation_space = self.preprocessor.observation_space
 
-    def step(self, action):
+    def _observe(self, reset=False):
+        ob = self.ch_ob.value
+        if self.preprocessor is None:
+            return ob
+        # Stacking updates one buffer in place, so observations the agent
+        # keeps must be copies
+        if reset:
+            return self.preprocessor.reset(ob).copy()
+        return self.preprocessor(ob).copy()
+
+    def step_async(self, action):
         self.ch_ac.value = action
         self.bridge.send()
+
+    def step_wait(self):
+        # The server may write the next observation while this one is still in
+        # use, unless it serves with ob_slots > 1
         self.bridge.recv()
+        return self._observe(), self.ch_reward.value, self.ch_done.value, {}
 
-        return self.ch_ob.value, self.ch_reward.value, self.ch_done.value, {}
+    def step(self, action):
+        self.step_async(action)
+        return self.step_wait()
 
-    def reset(self):
+    def step_sequence(self, actions):
+        # Runs the actions back to back, stopping early when the episode ends
+        # or the server runs out of timesteps. Returns the final observation,
+        # the reward of each step taken, whether the episode ended and the
+        # number of steps taken.
+        if self.ch_seq is None or self.preprocessor is not None:
+            return self._step_sequence_each(actions)
+        size = self.ch_seq.shape[0]
+        rewards = []
+        done = False
+        ob = None
+        for start in range(0, len(actions), size):
+            chunk = actions[start:start + size]
+            self.ch_seq.value[:len(chunk)] = chunk
+            self.ch_seq.dirty = True
+            self.ch_seq_len.value = len(chunk)
+            self.bridge.send()
+            self.bridge.recv()
+            steps = self.ch_seq_steps.value
+            rewards.extend(self.ch_seq_rewards.value[:steps])
+            ob = self.ch_ob.value
+            done = self.ch_done.value
+            if done or steps < len(chunk):
+                break
+        return ob, rewards, done, len(rewards)
+
+    def _step_sequence_each(self, actions):
+        rewards = []
+        done = False
+        ob = None
+        for action in actions:
+            ob, reward, done, _ = self.step(action)
+            rewards.append(reward)
+            if done:
+                break
+        return ob, rewards, done, len(rewards)
+
+    def reset_async(self):
         self.ch_reset.value = True
         self.bridge.send()
+
+    def reset_wait(self):
+        self.bridge.recv()
+        if getattr(self.ch_ob, 'history', 0):
+            self.ch_ob.fill_history()
+        return self._observe(reset=True)
+
+    def save_state(self):
+        # Returns a handle the server's current state can be restored from,
+        # until the server drops it to make room for newer ones
+        if self.ch_save is None:
+            raise NotImplementedError('The server does not save states')
+        self.ch_save.value = True
+        self.bridge.send()
+        self.bridge.recv()
+        return self.ch_state.value
+
+    def restore_state(self, handle):
+        # Returns the observation from when the state was saved
+        if self.ch_save is None:
+            raise NotImplementedError('The server does not save states')
+        self._request(self.ch_restore, handle)
+        if getattr(self.ch_ob, 'history', 0):
+            self.ch_ob.fill_history()
+        return self._observe(reset=True)
+
+    def fork(self, n):
+        # Forks n copies of the server from its env's current state and
+        # returns a client for each, to roll out independently of this one
+        if self.ch_fork is None:
+            raise NotImplementedError('The server does not fork')
+        self._request(self.ch_fork, n)
+        return [RemoteEnv(os.path.join(self.bridge.base, 'fork-%d' % pid), preprocess=self.preprocess,
+                          **self.bridge_kwargs) for pid in self.ch_fork_pids.value[:n]]
+
+    def _request(self, channel, value):
+        channel.value = value
+        self.bridge.send()
+        try:
+            self.bridge.recv()
+        except Exception:
+            # A refused request is answered with only an exception, so it is
+            # withdrawn here rather than sent again with the next step
+            channel.value = 0
+            channel.dirty = False
+            raise
+
+    def history(self):
+        # Servers started with ob_history keep the last few observations in a
+        # ring, which is read here oldest first without copying
+        if not getattr(self.ch_ob, 'history', 0):
+            raise NotImplementedError('The server does not keep an observation history')
+        return self.ch_ob.history_view()
+
+    def reset(self):
+        self.reset_async()
+        return self.reset_wait()
+
+    def close(self):
+        self.bridge.close()
+
+
+class VecRemoteEnv(RemoteEnv):
+    def __init__(self, directory, tries=8, **bridge_kwargs):
+        super(VecRemoteEnv, self).__init__(directory, tries=tries, **bridge_kwargs)
+        self.num_envs = int(self.ch_ob.annotations['batch'])
+
+    def step_wait(self):
         self.bridge.recv()
+
+        # Rewards and dones are small, so hand out copies the caller can keep
+        rewards = np.array(self.ch_reward.value)
+        dones = np.array(self.ch_done.value)
+        return self.ch_ob.value, rewards, dones, [{} for _ in range(self.num_envs)]
+
+    def step_sequence(self, actions):
+        raise NotImplementedError('Batched environments cannot step through sequences')
+
+
+class AsyncRemoteEnv:
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.ch_ac = self.bridge._channels['ac']
+        self.ch_ob = self.bridge._channels['ob']
+        self.ch_reward = self.bridge._channels['reward']
+        self.ch_done = self.bridge._channels['done']
+        self.ch_reset = self.bridge._channels['reset']
+        self.action_space = self.bridge.unwrap(self.ch_ac)
+        self.observation_space = self.bridge.unwrap(self.ch_ob)
+
+    @classmethod
+    async def connect(cls, directory, tries=8):
+        bridge = AsyncBridge(directory)
+
+        # Try a few times to connect
+        backoff = 2
+        for x in range(tries):
+            try:
+                await bridge.connect()
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if x + 1 == tries:
+                    raise
+                await asyncio.sleep(backoff)
+                backoff *= 2
+
+        await bridge.configure_client()
+        return cls(bridge)
+
+    async def step(self, action):
+        self.ch_ac.value = action
+        await self.bridge.send()
+        await self.bridge.recv()
+
+        return self.ch_ob.value, self.ch_reward.value, self.ch_done.value, {}
+
+    async def reset(self):
+        self.ch_reset.value = True
+        await self.bridge.send()
+        await self.bridge.recv()
         return self.ch_ob.value
 
     def close(self):
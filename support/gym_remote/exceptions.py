@@ -45,5 +45,21 @@ class ResetError(metaclass=GymRemoteErrorMeta):
     pass
 
 
+class RequestError(ValueError, metaclass=GymRemoteErrorMeta):
+    pass
+
+
+class WorkerDisconnectError(gr.Bridge.Closed, metaclass=GymRemoteErrorMeta):
+    pass
+
+
+class StateError(metaclass=GymRemoteErrorMeta):
+    pass
+
+
+class ForkError(metaclass=GymRemoteErrorMeta):
+    pass
+
+
 def make(id, *args, **kwargs):
     return GymRemoteErrorMeta.make(id, *args, **kwargs)
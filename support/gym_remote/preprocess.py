@@ -0,0 +1,125 @@
+import gym.spaces
+import numpy as np
+
+# A preprocessing spec is a list of operations applied in order, each a name
+# followed by its arguments, for example
+#   [['crop', 0, 224, 0, 320], ['grayscale'], ['downsample', 2], ['stack', 4]]
+# Specs come from untrusted agents, so every argument is checked.
+MAX_STACK = 16
+
+
+class Crop:
+    def __init__(self, top, bottom, left, right):
+        self.bounds = (int(top), int(bottom), int(left), int(right))
+
+    def shape(self, shape):
+        top, bottom, left, right = self.bounds
+        if len(shape) < 2:
+            raise ValueError('Cannot crop observations of shape %r' % (shape,))
+        if not 0 <= top < bottom <= shape[0] or not 0 <= left < right <= shape[1]:
+            raise ValueError('Crop %r does not fit observations of shape %r' % (self.bounds, shape))
+        return (bottom - top, right - left) + tuple(shape[2:])
+
+    def __call__(self, ob):
+        top, bottom, left, right = self.bounds
+        return ob[top:bottom, left:right]
+
+
+class Grayscale:
+    WEIGHTS = np.array([0.299, 0.587, 0.114], np.float32)
+
+    def shape(self, shape):
+        if len(shape) != 3 or shape[2] != 3:
+            raise ValueError('Grayscale needs RGB observations, not shape %r' % (shape,))
+        return tuple(shape[:2]) + (1,)
+
+    def __call__(self, ob):
+        gray = np.dot(ob, self.WEIGHTS)
+        return gray[:, :, np.newaxis].astype(ob.dtype)
+
+
+class Downsample:
+    def __init__(self, factor):
+        self.factor = int(factor)
+
+    def shape(self, shape):
+        if len(shape) < 2 or not 1 <= self.factor <= min(shape[:2]):
+            raise ValueError('Cannot downsample shape %r by %d' % (shape, self.factor))
+        return (shape[0] // self.factor, shape[1] // self.factor) + tuple(shape[2:])
+
+    def __call__(self, ob):
+        # Each output pixel is the mean of a factor by factor block
+        f = self.factor
+        h = ob.shape[0] // f
+        w = ob.shape[1] // f
+        blocks = ob[:h * f, :w * f].reshape((h, f, w, f) + ob.shape[2:])
+        return blocks.mean(axis=(1, 3)).astype(ob.dtype)
+
+
+class Stack:
+    def __init__(self, count):
+        self.count = int(count)
+        self.frames = None
+
+    def shape(self, shape):
+        if not 1 <= self.count <= MAX_STACK or len(shape) != 3:
+            raise ValueError('Cannot stack %d frames of shape %r' % (self.count, shape))
+        return tuple(shape[:2]) + (shape[2] * self.count,)
+
+    def reset(self, ob):
+        self.frames = np.concatenate([ob] * self.count, axis=2)
+        return self.frames
+
+    def __call__(self, ob):
+        if self.frames is None:
+            return self.reset(ob)
+        # Frames are stacked oldest first along the channel axis
+        channels = ob.shape[2]
+        self.frames[:, :, :-channels] = self.frames[:, :, channels:]
+        self.frames[:, :, -channels:] = ob
+        return self.frames
+
+
+OPERATIONS = {
+    'crop': Crop,
+    'grayscale': Grayscale,
+    'downsample': Downsample,
+    'stack': Stack,
+}
+
+
+class Preprocessor:
+    def __init__(self, spec, observation_space):
+        if not isinstance(observation_space, gym.spaces.Box):
+            raise ValueError('Only Box observations can be preprocessed')
+        if not isinstance(spec, (list, tuple)) or not all(isinstance(op, (list, tuple)) for op in spec):
+            raise ValueError('Preprocessing spec must be a list of operations: %r' % (spec,))
+        self.spec = [list(op) for op in spec]
+        self.operations = []
+        shape = tuple(observation_space.shape)
+        for op in self.spec:
+            if not op or not isinstance(op[0], str) or op[0] not in OPERATIONS:
+                raise ValueError('Unknown preprocessing operation: %r' % (op,))
+            try:
+                operation = OPERATIONS[op[0]](*op[1:])
+            except (TypeError, ValueError, OverflowError):
+                raise ValueError('Bad arguments for preprocessing operation: %r' % (op,))
+            shape = operation.shape(shape)
+            self.operations.append(operation)
+        dtype = observation_space.dtype
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=shape, dtype=dtype)
+
+    def reset(self, ob):
+        ob = np.asarray(ob)
+        for operation in self.operations:
+            if isinstance(operation, Stack):
+                ob = operation.reset(ob)
+            else:
+                ob = operation(ob)
+        return ob
+
+    def __call__(self, ob):
+        ob = np.asarray(ob)
+        for operation in self.operations:
+            ob = operation(ob)
+        return ob
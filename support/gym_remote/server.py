@@ -1,78 +1,662 @@
+import collections
+import copy
+import functools
 import gym
+import json
+import multiprocessing
+import numpy as np
+import os
+import selectors
+import signal
 import time
+import traceback
 
-from gym_remote import Bridge, FloatChannel, BoolChannel
+from gym_remote import Bridge, IntChannel, FloatChannel, BoolChannel, NpChannel
+from gym_remote.preprocess import Preprocessor
 import gym_remote.exceptions as gre
 
 
-class RemoteEnvWrapper(gym.Wrapper):
-    def __init__(self, env, directory):
-        gym.Wrapper.__init__(self, env)
-        self.bridge = Bridge(directory)
-        self.ch_ac = self.bridge.wrap('ac', env.action_space)
-        self.ch_ob = self.bridge.wrap('ob', env.observation_space)
-        self.ch_reward = self.bridge.add_channel('reward', FloatChannel())
-        self.ch_done = self.bridge.add_channel('done', BoolChannel())
-        self.ch_reset = self.bridge.add_channel('reset', BoolChannel())
-        self.bridge.listen()
-
-    def serve(self, timestep_limit=None, wallclock_limit=None, ignore_reset=False):
-        if wallclock_limit is not None:
-            end = time.time() + wallclock_limit
-            self.bridge.settimeout(wallclock_limit)
-        else:
-            end = None
-        ts = 0
+def serve(bridge, step, timestep_limit=None, wallclock_limit=None, accept_timeout=None, persistent=False,
+          on_accept=None):
+    # In persistent mode, a client that disconnects or is refused is followed
+    # by the next one to connect, which gets the timesteps and wallclock time
+    # that are left
+    if wallclock_limit is not None:
+        end = time.time() + wallclock_limit
+    else:
+        end = None
+    ts = 0
+    bridge.persistent = persistent
 
+    while True:
+        timeout = accept_timeout
+        if end is not None:
+            left = end - time.time()
+            if left <= 0:
+                return ts
+            timeout = left if timeout is None else min(timeout, left)
+        if timeout is not None:
+            bridge.settimeout(timeout)
         try:
-            self.bridge.server_accept()
+            bridge.server_accept()
         except Bridge.Timeout:
             return ts
+        except gre.RequestError:
+            if persistent:
+                continue
+            return ts
+        except Bridge.Closed:
+            # The client went away during the handshake
+            if not persistent:
+                raise
+            bridge.disconnect()
+            continue
+        if accept_timeout is not None and end is None:
+            bridge.settimeout(None)
+        if on_accept:
+            on_accept()
 
-        done = True
-
+        disconnected = False
         while timestep_limit is None or ts < timestep_limit:
             if wallclock_limit:
                 t = time.time()
                 if t >= end:
-                    self.bridge.close(exception=gre.WallClockTimeoutError)
-                    break
-                self.bridge.settimeout(end - t)
+                    bridge.close(exception=gre.WallClockTimeoutError)
+                    return ts
+                bridge.settimeout(end - t)
             try:
-                self.bridge.recv()
+                bridge.recv()
             except Bridge.Timeout:
-                self.bridge.close(exception=gre.WallClockTimeoutError)
-                break
+                bridge.close(exception=gre.WallClockTimeoutError)
+                return ts
+            except Bridge.Closed:
+                if persistent:
+                    bridge.disconnect()
+                    disconnected = True
+                    break
+                bridge.close(exception=gre.ClientDisconnectError)
+                return ts
+
+            # Each step replies to the client and reports the timesteps it used,
+            # which may be no more than the timesteps left
+            budget = None if timestep_limit is None else timestep_limit - ts
+            try:
+                ts += step(budget)
             except Bridge.Closed:
-                self.bridge.close(exception=gre.ClientDisconnectError)
+                if persistent and bridge.sock:
+                    # The client went away before the reply
+                    disconnected = True
+                    break
+                # The step failed and has already closed the bridge
+                return ts
+
+        if not disconnected:
+            break
+
+    if timestep_limit and ts >= timestep_limit:
+        bridge.close(exception=gre.TimestepTimeoutError)
+    return ts
+
+
+class RemoteEnvWrapper(gym.Wrapper):
+    # Seconds a forked server waits for its client before giving up
+    FORK_ACCEPT_TIMEOUT = 10
+
+    def __init__(self, env, directory, ob_slots=1, ob_history=0, max_sequence=0, allow_preprocess=False, listen=True,
+                 max_states=0, restore_cost=1, max_forks=0, **bridge_kwargs):
+        gym.Wrapper.__init__(self, env)
+        if max_states and (not hasattr(env, 'get_state') or not hasattr(env, 'set_state')):
+            raise ValueError('Saving states needs an env with get_state and set_state')
+        self.ob_slots = ob_slots
+        self.ob_history = ob_history
+        self.max_sequence = max_sequence
+        self.allow_preprocess = allow_preprocess
+        self.preprocessor = None
+        # Clients can save up to max_states snapshots of the env, through its
+        # get_state and set_state, and branch from them. The least recently
+        # used snapshot is dropped first, and each restore uses restore_cost
+        # timesteps.
+        self.max_states = max_states
+        self.restore_cost = restore_cost
+        self.states = collections.OrderedDict()
+        self._last_state = 0
+        # Clients can also fork up to max_forks copies of the server, each
+        # serving its own client from the state the env was in
+        self.max_forks = max_forks
+        self.forks = []
+        self.bridge_kwargs = bridge_kwargs
+        self._add_channels(directory)
+        if max_forks and self.bridge.address:
+            raise ValueError('Forking needs a socket directory')
+        if listen:
+            self.bridge.listen()
+        self._done = True
+        self._ignore_reset = False
+        self._end = None
+
+    def _add_channels(self, directory, forked=False):
+        bridge_kwargs = self.bridge_kwargs
+        if forked:
+            # Forks get their own directory and must not overwrite the parent's stats
+            bridge_kwargs = dict(bridge_kwargs, namespace=None, stats_path=None)
+        self.bridge = Bridge(directory, **bridge_kwargs)
+        self.ch_ac = self.bridge.wrap('ac', self.env.action_space)
+        if self.allow_preprocess and not forked:
+            # The observation channel is sized once the client says how it
+            # wants observations preprocessed
+            self.ch_ob = None
+            self.bridge.request_handler = self._handle_request
+        else:
+            self._wrap_ob()
+        self.ch_reward = self.bridge.add_channel('reward', FloatChannel())
+        self.ch_done = self.bridge.add_channel('done', BoolChannel())
+        self.ch_reset = self.bridge.add_channel('reset', BoolChannel())
+        self.ch_seq = None
+        if self.max_sequence:
+            # Clients can send up to max_sequence actions to run back to back
+            self.ch_seq = self.bridge.wrap_batch('ac_seq', self.env.action_space, self.max_sequence)
+            self.ch_seq_len = self.bridge.add_channel('seq_len', IntChannel())
+            self.ch_seq_steps = self.bridge.add_channel('seq_steps', IntChannel())
+            self.ch_seq_rewards = self.bridge.add_channel('seq_rewards', NpChannel((self.max_sequence,), np.float64))
+        self.ch_save = None
+        if self.max_states:
+            self.ch_save = self.bridge.add_channel('save_state', BoolChannel())
+            self.ch_restore = self.bridge.add_channel('restore_state', IntChannel())
+            self.ch_state = self.bridge.add_channel('state', IntChannel())
+        self.ch_fork = None
+        if self.max_forks and not forked:
+            self.ch_fork = self.bridge.add_channel('fork', IntChannel())
+            self.ch_fork_pids = self.bridge.add_channel('fork_pids', NpChannel((self.max_forks,), np.int64))
+
+    def _wrap_ob(self):
+        space = self.env.observation_space
+        if self.preprocessor is not None:
+            space = self.preprocessor.observation_space
+        self.ch_ob = self.bridge.wrap('ob', space, slots=self.ob_slots, history=self.ob_history)
+        if self.preprocessor is not None:
+            self.ch_ob.annotate('preprocess', json.dumps(self.preprocessor.spec))
+
+    def serve(self, timestep_limit=None, wallclock_limit=None, ignore_reset=False, persistent=False):
+        self._ignore_reset = ignore_reset
+        self._end = None if wallclock_limit is None else time.time() + wallclock_limit
+        step = functools.partial(self._serve_step, ignore_reset)
+        return serve(self.bridge, step, timestep_limit, wallclock_limit, persistent=persistent,
+                     on_accept=self._new_client)
+
+    def _new_client(self):
+        # Every client may start with a reset, even one that takes over an env
+        # in the middle of an episode
+        self._done = True
+
+    def _handle_request(self, request):
+        if not isinstance(request, dict):
+            raise ValueError('Requests must be JSON objects')
+        spec = request.get('preprocess')
+        preprocessor = None
+        if spec:
+            preprocessor = Preprocessor(spec, self.env.observation_space)
+        if self.ch_ob is not None:
+            # In persistent mode the channel outlives the client it was sized
+            # for, so later clients must ask for the same preprocessing
+            old_spec = self.preprocessor.spec if self.preprocessor else None
+            if (preprocessor.spec if preprocessor else None) != old_spec:
+                raise ValueError('This server preprocesses observations with %r' % (old_spec,))
+            # Keep the running preprocessor, whose history the env carries on from
+            return
+        self.preprocessor = preprocessor
+        self._wrap_ob()
+
+    def _observe(self, ob, reset=False):
+        if self.preprocessor is None:
+            return ob
+        if reset:
+            return self.preprocessor.reset(ob)
+        return self.preprocessor(ob)
+
+    def _serve_step(self, ignore_reset=False, budget=None):
+        if self.ch_fork is not None and self.ch_fork.value:
+            return self._serve_fork(budget)
+        if self.ch_save is not None and (self.ch_save.value or self.ch_restore.value):
+            return self._serve_state(budget)
+        if self.ch_seq is not None and self.ch_seq_len.value:
+            return self._serve_sequence(ignore_reset, budget)
+        if self.ch_reset.value:
+            if ignore_reset and not self._done:
+                self.bridge.exception(gre.ResetError)
+                self.bridge.send()
+                return 0
+            self.ch_ob.value = self._observe(self.env.reset(), reset=True)
+            self.ch_reset.value = False
+            self.ch_reward.value = 0
+            self.ch_done.value = False
+            self._done = False
+        else:
+            if ignore_reset and self._done:
+                self.bridge.exception(gre.ResetError)
+                self.bridge.send()
+                return 0
+            ob, rew, self._done, _ = self.env.step(self.ch_ac.value)
+            self.ch_ob.value = self._observe(ob)
+            self.ch_reward.value = rew
+            self.ch_done.value = self._done
+        self.bridge.send()
+        return 1
+
+    def _serve_sequence(self, ignore_reset=False, budget=None):
+        count = self.ch_seq_len.value
+        self.ch_seq_len.value = 0
+        if ignore_reset and self._done:
+            self.bridge.exception(gre.ResetError)
+            self.bridge.send()
+            return 0
+        if budget is not None:
+            count = min(count, budget)
+        rewards = np.zeros(self.ch_seq_rewards.shape)
+        steps = 0
+        for action in self.ch_seq.value[:count]:
+            if action.ndim == 0:
+                action = action.item()
+            ob, rewards[steps], self._done, _ = self.env.step(action)
+            # Every frame is preprocessed, since stacking needs them all
+            ob = self._observe(ob)
+            if self.ob_history:
+                # and the history holds them all, as if they were stepped one by one
+                self.ch_ob.value = ob
+            steps += 1
+            if self._done:
                 break
+        if steps and not self.ob_history:
+            self.ch_ob.value = ob
+            self.ch_reward.value = rewards[steps - 1]
+        self.ch_done.value = self._done
+        self.ch_seq_rewards.value = rewards
+        self.ch_seq_steps.value = steps
+        self.bridge.send()
+        return steps
+
+    def _serve_state(self, budget=None):
+        if self.ch_save.value:
+            self.ch_save.value = False
+            self._last_state += 1
+            # The observation and preprocessing state are kept too, since the
+            # env cannot be asked for its current observation
+            self.states[self._last_state] = (self.env.get_state(), np.array(self.ch_ob.value),
+                                             copy.deepcopy(self.preprocessor), self._done)
+            if len(self.states) > self.max_states:
+                self.states.popitem(last=False)
+            self.ch_state.value = self._last_state
+            self.bridge.send()
+            return 0
+        handle = self.ch_restore.value
+        self.ch_restore.value = 0
+        if handle not in self.states:
+            # Only the exception is sent, so the client's next call does not
+            # read a stale update
+            self.bridge.exception(gre.StateError, 'Unknown or evicted state %d' % handle)
+            return 0
+        self.states.move_to_end(handle)
+        state, ob, preprocessor, self._done = self.states[handle]
+        self.env.set_state(state)
+        self.preprocessor = copy.deepcopy(preprocessor)
+        self.ch_ob.value = ob
+        self.ch_reward.value = 0
+        self.ch_done.value = self._done
+        self.bridge.send()
+        if budget is not None:
+            return min(self.restore_cost, budget)
+        return self.restore_cost
+
+    def _serve_fork(self, budget=None):
+        count = self.ch_fork.value
+        self.ch_fork.value = 0
+        self._reap_forks()
+        if not 0 < count <= self.max_forks - len(self.forks):
+            self.bridge.exception(gre.ForkError, 'Cannot fork %d envs with %d of %d running' %
+                                  (count, len(self.forks), self.max_forks))
+            return 0
+        # The timesteps left are split evenly between this server and its
+        # forks, and the forks' shares are charged here up front
+        share = None
+        if budget is not None:
+            share = budget // (count + 1)
+            if not share:
+                self.bridge.exception(gre.ForkError, 'Cannot fork %d envs with %d timesteps left' % (count, budget))
+                return 0
+        pids = []
+        parent = os.getpid()
+        for i in range(count):
+            ready_in, ready_out = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(ready_in)
+                self._run_fork(ready_out, share, parent)
+            os.close(ready_out)
+            # Children say when they are listening, so clients can connect at once
+            ready = os.read(ready_in, 1)
+            os.close(ready_in)
+            self.forks.append(pid)
+            if not ready:
+                self.bridge.exception(gre.ForkError, 'A forked server failed to start')
+                return i * share if share else 0
+            pids.append(pid)
+        self.ch_fork_pids.value = pids + [0] * (self.max_forks - count)
+        self.bridge.send()
+        return count * share if share else 0
+
+    def _run_fork(self, ready, budget, parent):
+        # Runs in the child: the env is shared with the parent copy-on-write,
+        # and a new bridge in its own directory serves one client within its
+        # share of the timesteps and the wallclock time the parent had left.
+        # Forks cannot fork again.
+        status = 0
+        try:
+            _die_with_parent(parent)
+            ob = np.array(self.ch_ob.value)
+            directory = os.path.join(self.bridge.base, 'fork-%d' % os.getpid())
+            self.bridge.detach()
+            self.forks = []
+            os.mkdir(directory)
+            self._add_channels(directory, forked=True)
+            self.ch_ob.value = ob
+            self.bridge.listen()
+            os.write(ready, b'\0')
+            os.close(ready)
+            wallclock_limit = None
+            if self._end is not None:
+                wallclock_limit = max(self._end - time.time(), 0)
+            step = functools.partial(self._serve_step, self._ignore_reset)
+            serve(self.bridge, step, budget, wallclock_limit, accept_timeout=self.FORK_ACCEPT_TIMEOUT)
+            self.bridge.close()
+            os.rmdir(directory)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _reap_forks(self):
+        running = []
+        for pid in self.forks:
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0] == 0:
+                    running.append(pid)
+            except ChildProcessError:
+                pass
+        self.forks = running
+
+    def close(self):
+        self.bridge.close()
+        self._reap_forks()
+        self.env.close()
+
+
+class VecRemoteEnvWrapper:
+    def __init__(self, envs, directory, ob_slots=1, **bridge_kwargs):
+        self.envs = list(envs)
+        self._add_channels(len(self.envs), self.envs[0].action_space, self.envs[0].observation_space, directory,
+                           ob_slots, bridge_kwargs)
+
+    def _add_channels(self, num_envs, action_space, observation_space, directory, ob_slots, bridge_kwargs, listen=True):
+        self.num_envs = num_envs
+        self.action_space = action_space
+        self.observation_space = observation_space
+        self.bridge = Bridge(directory, **bridge_kwargs)
+        self.ch_ac = self.bridge.wrap_batch('ac', self.action_space, self.num_envs)
+        self.ch_ob = self.bridge.wrap_batch('ob', self.observation_space, self.num_envs, slots=ob_slots)
+        self.ch_reward = self.bridge.add_channel('reward', NpChannel((self.num_envs,), np.float64))
+        self.ch_done = self.bridge.add_channel('done', NpChannel((self.num_envs,), np.bool_))
+        self.ch_reset = self.bridge.add_channel('reset', BoolChannel())
+        if listen:
+            self.bridge.listen()
+
+    def serve(self, timestep_limit=None, wallclock_limit=None, persistent=False):
+        # A batch step uses one timestep per environment, so the limit can be
+        # overshot by up to num_envs - 1 timesteps
+        return serve(self.bridge, self._serve_step, timestep_limit, wallclock_limit, persistent=persistent)
+
+    def _serve_step(self, budget=None):
+        if self.ch_reset.value:
+            self.ch_ob.value = [env.reset() for env in self.envs]
+            self.ch_reset.value = False
+            self.ch_reward.value = 0
+            self.ch_done.value = False
+        else:
+            obs = []
+            rews = []
+            dones = []
+            for env, action in zip(self.envs, self.ch_ac.value):
+                if action.ndim == 0:
+                    action = action.item()
+                ob, rew, done, _ = env.step(action)
+                # Finished environments are reset so that every slot stays live
+                if done:
+                    ob = env.reset()
+                obs.append(ob)
+                rews.append(rew)
+                dones.append(done)
+            self.ch_ob.value = obs
+            self.ch_reward.value = rews
+            self.ch_done.value = dones
+        self.bridge.send()
+        return self.num_envs
+
+    def close(self):
+        self.bridge.close()
+        for env in self.envs:
+            env.close()
+
+
+def _die_with_parent(ppid):
+    # Workers hold emulators, so they must not outlive a server that was killed
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        # PR_SET_PDEATHSIG
+        libc.prctl(1, signal.SIGKILL)
+    except (OSError, AttributeError):
+        pass
+    if os.getppid() != ppid:
+        os._exit(0)
+
+
+def _probe_spaces(make_env, pipe):
+    env = make_env()
+    pipe.send((env.action_space, env.observation_space))
+    env.close()
+
+
+def _pool_worker(make_env, index, ch_ob, pipe, ppid, inherited):
+    _die_with_parent(ppid)
+    # Without the server's ends of the pipes and its socket, a server that
+    # goes away shows up here as the end of the pipe
+    for handle in inherited:
+        handle.close()
+    env = make_env()
+    while True:
+        try:
+            command, slot, action = pipe.recv()
+        except EOFError:
+            break
+        if command == 'close':
+            break
+        if command == 'reset':
+            ob = env.reset()
+            rew, done = 0.0, False
+        else:
+            ob, rew, done, _ = env.step(action)
+            if done:
+                ob = env.reset()
+        # The observation goes straight into this env's row of the batch
+        ch_ob.slot_value(slot)[index] = ob
+        pipe.send((rew, done))
+    env.close()
+    pipe.close()
 
+
+class ProcessVecRemoteEnvWrapper(VecRemoteEnvWrapper):
+    # Steps num_envs environments from make_env in forked worker processes,
+    # for environments such as Gym Retro that allow only one per process.
+    # Workers inherit the batch observation mapping and write their own rows.
+    def __init__(self, make_env, num_envs, directory, ob_slots=1, **bridge_kwargs):
+        self.envs = []
+        context = multiprocessing.get_context('fork')
+        # Spaces come from a throwaway env so that this process never makes one
+        pipe, child = context.Pipe()
+        probe = context.Process(target=_probe_spaces, args=(make_env, child), daemon=True)
+        probe.start()
+        child.close()
+        action_space, observation_space = pipe.recv()
+        probe.join()
+        pipe.close()
+        self._add_channels(num_envs, action_space, observation_space, directory, ob_slots, bridge_kwargs, listen=False)
+        self.pipes = []
+        self.workers = []
+        for index in range(num_envs):
+            pipe, child = context.Pipe()
+            inherited = self.pipes + [pipe, self.bridge.sock]
+            worker = context.Process(target=_pool_worker, args=(make_env, index, self.ch_ob, child, os.getpid(), inherited),
+                                     daemon=True)
+            worker.start()
+            child.close()
+            self.pipes.append(pipe)
+            self.workers.append(worker)
+        self.bridge.listen()
+
+    def _serve_step(self, budget=None):
+        slot = self.ch_ob.claim()
+        try:
             if self.ch_reset.value:
-                if ignore_reset and not done:
-                    self.bridge.exception(gre.ResetError)
-                    self.bridge.send()
-                    continue
-                self.ch_ob.value = self.env.reset()
+                for pipe in self.pipes:
+                    pipe.send(('reset', slot, None))
                 self.ch_reset.value = False
-                self.ch_reward.value = 0
-                self.ch_done.value = False
-                done = False
             else:
-                if ignore_reset and done:
-                    self.bridge.exception(gre.ResetError)
-                    self.bridge.send()
-                    continue
-                ob, rew, done, _ = self.env.step(self.ch_ac.value)
-                self.ch_ob.value = ob
-                self.ch_reward.value = rew
-                self.ch_done.value = done
-            self.bridge.send()
-            ts += 1
+                for pipe, action in zip(self.pipes, self.ch_ac.value):
+                    if action.ndim == 0:
+                        action = action.item()
+                    pipe.send(('step', slot, action))
+            # Workers step in parallel, and the client gets one reply once all are done
+            results = [pipe.recv() for pipe in self.pipes]
+        except (EOFError, OSError):
+            self.bridge.close(reason='An environment worker exited', exception=gre.WorkerDisconnectError)
+            raise gre.WorkerDisconnectError('An environment worker exited')
+        self.ch_ob.commit()
+        self.ch_reward.value = [rew for rew, _ in results]
+        self.ch_done.value = [done for _, done in results]
+        self.bridge.send()
+        return self.num_envs
+
+    def close(self):
+        self.bridge.close()
+        for pipe in self.pipes:
+            try:
+                pipe.send(('close', None, None))
+            except OSError:
+                pass
+            pipe.close()
+        for worker in self.workers:
+            worker.join()
+        self.pipes = []
+        self.workers = []
+
+
+class _Session:
+    def __init__(self, wrapper, fds):
+        self.wrapper = wrapper
+        self.fds = fds
+        self.ts = 0
 
-        if timestep_limit and ts >= timestep_limit:
-            self.bridge.close(exception=gre.TimestepTimeoutError)
+
+class MultiRemoteEnvServer:
+    # Serves several clients from one socket directory. Each client gets its
+    # own env from make_env and its own namespace directory for channel files.
+    # Handshakes block the other sessions, so clients that stall during one
+    # are dropped after handshake_timeout seconds.
+    def __init__(self, make_env, directory, max_clients=None, handshake_timeout=10, **wrapper_kwargs):
+        self.make_env = make_env
+        self.directory = directory
+        self.max_clients = max_clients
+        self.handshake_timeout = handshake_timeout
+        self.wrapper_kwargs = wrapper_kwargs
+        self.listener = Bridge(directory)
+        self.listener.listen(backlog=max_clients or 16)
+        self.sessions = set()
+        self.clients = 0
+        self._selector = None
+
+    def serve(self, timestep_limit=None, wallclock_limit=None, ignore_reset=False, clients=None):
+        # Limits apply to each client. Serving stops once clients sessions have
+        # ended, or when the wallclock limit ends every open session.
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.listener.sock, selectors.EVENT_READ, None)
+        end = None if wallclock_limit is None else time.time() + wallclock_limit
+        ended = 0
+        ts = 0
+        while clients is None or ended < clients:
+            timeout = None
+            if end is not None:
+                timeout = end - time.time()
+                if timeout <= 0:
+                    break
+            for key, _ in self._selector.select(timeout):
+                session = key.data
+                if session is None:
+                    ended += self._accept()
+                elif session in self.sessions:
+                    used, done = self._serve_session(session, timestep_limit, ignore_reset)
+                    ts += used
+                    ended += done
+        for session in list(self.sessions):
+            self._end_session(session, gre.WallClockTimeoutError)
+        self._selector.close()
+        self._selector = None
         return ts
 
+    def _accept(self):
+        connection, _ = self.listener.sock.accept()
+        self.clients += 1
+        wrapper = RemoteEnvWrapper(self.make_env(), self.directory, listen=False, namespace='client-%d' % self.clients,
+                                   **self.wrapper_kwargs)
+        connection.settimeout(self.handshake_timeout)
+        try:
+            wrapper.bridge.adopt(connection)
+        except (Bridge.Closed, Bridge.Timeout, gre.RequestError):
+            wrapper.close()
+            return 1
+        connection.settimeout(None)
+        session = _Session(wrapper, wrapper.bridge.selectables())
+        for fd in session.fds:
+            self._selector.register(fd, selectors.EVENT_READ, session)
+        self.sessions.add(session)
+        if self.max_clients and len(self.sessions) >= self.max_clients:
+            # Further clients wait in the listen backlog until a session ends
+            self._selector.unregister(self.listener.sock)
+        return 0
+
+    def _serve_session(self, session, timestep_limit, ignore_reset):
+        wrapper = session.wrapper
+        used = 0
+        try:
+            while wrapper.bridge.try_recv():
+                budget = None if timestep_limit is None else timestep_limit - session.ts
+                ts = wrapper._serve_step(ignore_reset, budget)
+                session.ts += ts
+                used += ts
+                if timestep_limit is not None and session.ts >= timestep_limit:
+                    self._end_session(session, gre.TimestepTimeoutError)
+                    return used, 1
+        except Bridge.Closed:
+            self._end_session(session, gre.ClientDisconnectError)
+            return used, 1
+        return used, 0
+
+    def _end_session(self, session, exception):
+        for fd in session.fds:
+            self._selector.unregister(fd)
+        self.sessions.remove(session)
+        session.wrapper.bridge.close(exception=exception)
+        session.wrapper.close()
+        if self.max_clients and len(self.sessions) == self.max_clients - 1:
+            self._selector.register(self.listener.sock, selectors.EVENT_READ, None)
+
     def close(self):
-        self.bridge.close()
-        self.env.close()
+        self.listener.close()
@@ -0,0 +1,84 @@
+import gym
+import gym.spaces
+import multiprocessing
+import tempfile
+
+# Small environments and a server harness shared by the tests and benchmarks
+
+
+class BitEnv(gym.Env):
+    def __init__(self):
+        self.action_space = gym.spaces.Discrete(8)
+        self.observation_space = gym.spaces.Discrete(2)
+
+    def step(self, action):
+        assert self.action_space.contains(action)
+        observation = action & 1
+        reward = float(action & 2)
+        done = bool(action & 4)
+        return observation, reward, done, {}
+
+    def reset(self):
+        return 0
+
+
+class MultiBitEnv(gym.Env):
+    def __init__(self):
+        self.action_space = gym.spaces.MultiBinary(3)
+        self.observation_space = gym.spaces.Discrete(2)
+
+    def step(self, action):
+        assert self.action_space.contains(action)
+        observation = action[0]
+        reward = float(action[1])
+        done = bool(action[2])
+        return observation, reward, done, {}
+
+    def reset(self):
+        return 0
+
+
+class StepEnv(gym.Env):
+    def __init__(self):
+        self.action_space = gym.spaces.Discrete(2)
+        self.observation_space = gym.spaces.Discrete(1)
+        self.reward = 0
+        self.done = False
+
+    def step(self, action):
+        if not self.done:
+            self.reward += 1
+        if action:
+            self.done = True
+        return 0, self.reward, self.done, {}
+
+    def reset(self):
+        self.reward = 0
+        self.done = False
+        return 0
+
+
+def run_wrapper(make_wrapper, make_client):
+    with tempfile.TemporaryDirectory() as dir:
+        def serve(pipe):
+            make_env, wrapper_kwargs = pipe.recv()
+            env = make_wrapper(make_env, dir, **wrapper_kwargs)
+            pipe.send('ok')
+
+            args = pipe.recv()
+            kwargs = pipe.recv()
+            env.serve(*args, **kwargs)
+
+        parent_pipe, child_pipe = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=serve, args=(child_pipe,))
+        proc.start()
+
+        def call(env, *args, wrapper_kwargs={}, client_kwargs={}, **kwargs):
+            parent_pipe.send((env, wrapper_kwargs))
+            assert parent_pipe.recv() == 'ok'
+            parent_pipe.send(args)
+            parent_pipe.send(kwargs)
+            return make_client(dir, **client_kwargs)
+
+        yield call
+        proc.terminate()
@@ -1,6 +1,11 @@
 import csv
+import glob
 import gym
+import json
 import numpy as np
+import os
+import queue
+import threading
 import time
 
 
@@ -37,6 +42,42 @@ class StochasticFrameSkip(gym.Wrapper):
         return ob, totrew, done, info
 
 
+class FastReset(gym.Wrapper):
+    # Wraps a retro env directly. The first reset goes through retro, and the
+    # emulator state and observation it leaves are kept in memory; later
+    # resets restore them without the rest of the reset path. Movies are only
+    # started by a full reset, so this is not for envs recording bk2 files.
+    def __init__(self, env):
+        gym.Wrapper.__init__(self, env)
+        self.snapshot = None
+        self.ob = None
+
+    def reset(self, **kwargs):
+        retro_env = self.env.unwrapped
+        if self.snapshot is None or kwargs:
+            ob = self.env.reset(**kwargs)
+            self.snapshot = retro_env.em.get_state()
+            self.ob = np.array(ob)
+            return ob
+        retro_env.em.set_state(self.snapshot)
+        retro_env.data.reset()
+        retro_env.data.update_ram()
+        return self.ob.copy()
+
+
+class EmulatorState(gym.Wrapper):
+    # Wraps a retro env directly, exposing its emulator state so that servers
+    # can save and restore it. Outer wrappers keep their own state, such as
+    # the steps counted towards a time limit.
+    def get_state(self):
+        return self.env.unwrapped.em.get_state()
+
+    def set_state(self, state):
+        retro_env = self.env.unwrapped
+        retro_env.em.set_state(state)
+        retro_env.data.update_ram()
+
+
 class Monitor(gym.Wrapper):
     def __init__(self, env, monitorfile, logfile=None):
         gym.Wrapper.__init__(self, env)
@@ -82,3 +123,97 @@ class Monitor(gym.Wrapper):
 
     def __del__(self):
         self.file.close()
+
+
+class TrajectoryRecorder(gym.Wrapper):
+    # Each step is written as (observation, action, reward, done), where the
+    # observation is the one the action was taken on. Chunks are .npy files
+    # preallocated for chunk_size steps; chunk_NNNNNN.json records how many
+    # steps a chunk holds once it is finished.
+    def __init__(self, env, directory, chunk_size=1000, queue_size=256, copy=True):
+        gym.Wrapper.__init__(self, env)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.copy = copy
+        self.ob = None
+        self.chunk = 0
+        self.length = 0
+        self.arrays = None
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def reset(self, **kwargs):
+        self.ob = self.env.reset(**kwargs)
+        return self.ob
+
+    def step(self, ac):
+        ob, rew, done, info = self.env.step(ac)
+        record = self.ob
+        if self.copy:
+            record = np.array(record)
+        # The serve loop only waits here if the writer falls a whole queue behind.
+        # Array actions can be shared memory the client rewrites, so they are copied.
+        self.queue.put((record, np.array(ac), rew, done))
+        self.ob = ob
+        return ob, rew, done, info
+
+    def _open_chunk(self, ob, ac):
+        fields = {
+            'obs': (ob.shape, ob.dtype),
+            'actions': (ac.shape, ac.dtype),
+            'rewards': ((), np.float64),
+            'dones': ((), np.bool_),
+        }
+        self.arrays = {}
+        for name, (shape, dtype) in fields.items():
+            path = os.path.join(self.directory, 'chunk_%06d_%s.npy' % (self.chunk, name))
+            self.arrays[name] = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(self.chunk_size,) + shape)
+        self.length = 0
+
+    def _close_chunk(self):
+        for array in self.arrays.values():
+            array.flush()
+        with open(os.path.join(self.directory, 'chunk_%06d.json' % self.chunk), 'w') as f:
+            json.dump({'length': self.length}, f)
+        self.arrays = None
+        self.chunk += 1
+
+    def _write(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            ob, ac, rew, done = record
+            if self.arrays is None:
+                self._open_chunk(np.asarray(ob), ac)
+            self.arrays['obs'][self.length] = ob
+            self.arrays['actions'][self.length] = ac
+            self.arrays['rewards'][self.length] = rew
+            self.arrays['dones'][self.length] = done
+            self.length += 1
+            if self.length == self.chunk_size:
+                self._close_chunk()
+        if self.arrays is not None:
+            self._close_chunk()
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.env.close()
+
+
+def iter_trajectories(directory):
+    # Yields one dict of read-only memory-mapped arrays per finished chunk, so
+    # nothing is read into memory until it is used
+    for meta in sorted(glob.glob(os.path.join(directory, 'chunk_*.json'))):
+        with open(meta) as f:
+            length = json.load(f)['length']
+        prefix = meta[:-len('.json')]
+        chunk = {}
+        for name in ('obs', 'actions', 'rewards', 'dones'):
+            chunk[name] = np.load('%s_%s.npy' % (prefix, name), mmap_mode='r')[:length]
+        yield chunk
@@ -4,7 +4,7 @@ import gym
 import gym.wrappers
 
 
-def make(game, state=retro.State.DEFAULT, discrete_actions=False, bk2dir=None):
+def make(game, state=retro.State.DEFAULT, discrete_actions=False, bk2dir=None, fast_reset=False):
     use_restricted_actions = retro.Actions.FILTERED
     if discrete_actions:
         use_restricted_actions = retro.Actions.DISCRETE
@@ -14,6 +14,9 @@ def make(game, state=retro.State.DEFAULT, discrete_actions=False, bk2dir=None):
         env = retro.make(game, state, use_restricted_actions=use_restricted_actions)
     if bk2dir:
         env.auto_record(bk2dir)
+    env = retro_contest.EmulatorState(env)
+    if fast_reset and not bk2dir:
+        env = retro_contest.FastReset(env)
     env = retro_contest.StochasticFrameSkip(env, n=4, stickprob=0.25)
     env = gym.wrappers.TimeLimit(env, max_episode_steps=4500)
     return env
@@ -1,4 +1,5 @@
 import argparse
+import functools
 import gym
 import gym_remote.server as grs
 import os
@@ -8,27 +9,62 @@ import retro_contest.local
 import sys
 
 
-def make(game, state=retro.STATE_DEFAULT, bk2dir=None, monitordir=None, discrete_actions=False, socketdir=None):
+def make(game, state=retro.STATE_DEFAULT, bk2dir=None, monitordir=None, discrete_actions=False, socketdir=None, ob_slots=1,
+         trajectorydir=None, fast_reset=False, **wrapper_kwargs):
+    if wrapper_kwargs.get('max_forks') and (bk2dir or monitordir or trajectorydir):
+        # Forks would write into the parent's recordings, and a forked
+        # TrajectoryRecorder has no writer thread to drain its queue
+        raise ValueError('Movies, monitors and trajectories are not supported with forks')
     if bk2dir:
         os.makedirs(bk2dir, exist_ok=True)
-    env = retro_contest.local.make(game, state, discrete_actions=discrete_actions, bk2dir=bk2dir)
+    env = retro_contest.local.make(game, state, discrete_actions=discrete_actions, bk2dir=bk2dir, fast_reset=fast_reset)
     if monitordir:
         env = retro_contest.Monitor(env, os.path.join(monitordir, 'monitor.csv'), os.path.join(monitordir, 'log.csv'))
-    env = grs.RemoteEnvWrapper(env, socketdir)
+        if wrapper_kwargs.get('instrument'):
+            wrapper_kwargs['stats_path'] = os.path.join(monitordir, 'bridge.json')
+    if trajectorydir:
+        env = retro_contest.TrajectoryRecorder(env, trajectorydir)
+    env = grs.RemoteEnvWrapper(env, socketdir, ob_slots=ob_slots, **wrapper_kwargs)
     return env
 
 
+def make_pool(game, state=retro.STATE_DEFAULT, num_envs=2, discrete_actions=False, socketdir=None, ob_slots=1,
+              fast_reset=False, **bridge_kwargs):
+    # Retro allows one emulator per process, so each env runs in its own worker
+    make_env = functools.partial(retro_contest.local.make, game, state, discrete_actions=discrete_actions,
+                                 fast_reset=fast_reset)
+    return grs.ProcessVecRemoteEnvWrapper(make_env, num_envs, socketdir, ob_slots=ob_slots, **bridge_kwargs)
+
+
 def run(game, state,
         wallclock_limit=None, timestep_limit=None,
         monitordir=None, bk2dir=None, socketdir=None,
-        discrete_actions=False, daemonize=False):
+        discrete_actions=False, daemonize=False, ob_slots=1, trajectorydir=None, num_envs=1, persistent=False,
+        **wrapper_kwargs):
+    if num_envs > 1:
+        if bk2dir or monitordir or trajectorydir:
+            raise ValueError('Movies, monitors and trajectories are not supported with several environments')
+        for key in ('max_sequence', 'ob_history', 'allow_preprocess', 'max_states', 'max_forks'):
+            if wrapper_kwargs.pop(key, None):
+                raise ValueError('%s is not supported with several environments' % key)
+        # Only meaningful with saved states, which pools do not support
+        wrapper_kwargs.pop('restore_cost', None)
     if daemonize:
         pid = os.fork()
         if pid > 0:
             return
 
-    env = make(game, state, bk2dir, monitordir, discrete_actions, socketdir)
-    env.serve(timestep_limit=timestep_limit, wallclock_limit=wallclock_limit, ignore_reset=True)
+    if num_envs > 1:
+        env = make_pool(game, state, num_envs, discrete_actions, socketdir, ob_slots, **wrapper_kwargs)
+        env.serve(timestep_limit=timestep_limit, wallclock_limit=wallclock_limit, persistent=persistent)
+        env.close()
+        return
+    env = make(game, state, bk2dir, monitordir, discrete_actions, socketdir, ob_slots, trajectorydir, **wrapper_kwargs)
+    env.serve(timestep_limit=timestep_limit, wallclock_limit=wallclock_limit, ignore_reset=True,
+              persistent=persistent)
+    if trajectorydir:
+        # Finish writing the last trajectory chunk
+        env.close()
 
 
 def run_args(args):
@@ -36,10 +72,28 @@ def run_args(args):
         wallclock_limit=args.wallclock_limit,
         timestep_limit=args.timestep_limit,
         bk2dir=args.bk2dir,
+        trajectorydir=args.trajectorydir,
         monitordir=args.monitordir,
         socketdir=args.socketdir,
         discrete_actions=args.discrete_actions,
-        daemonize=args.daemonize)
+        daemonize=args.daemonize,
+        num_envs=args.num_envs,
+        persistent=args.persistent,
+        fast_reset=args.fast_reset,
+        framing=args.framing,
+        ob_slots=args.ob_slots,
+        wakeup=args.wakeup,
+        spin_us=args.spin_us,
+        compression=args.compression,
+        keyframe_interval=args.keyframe_interval,
+        memory=args.memory,
+        instrument=args.stats,
+        max_sequence=args.max_sequence,
+        ob_history=args.ob_history,
+        allow_preprocess=args.allow_preprocess,
+        max_states=args.max_states,
+        restore_cost=args.restore_cost,
+        max_forks=args.max_forks)
 
 
 def list_games(args):
@@ -78,11 +132,29 @@ def main(argv=sys.argv[1:]):
     parser_run.add_argument('state', type=str, default=retro.State.DEFAULT, nargs='?', help='Name of initial state')
     parser_run.add_argument('--monitordir', '-m', type=str, help='Directory to hold monitor files')
     parser_run.add_argument('--bk2dir', '-b', type=str, help='Directory to hold BK2 movies')
-    parser_run.add_argument('--socketdir', '-s', type=str, default='tmp/sock', help='Directory to hold sockets')
+    parser_run.add_argument('--trajectorydir', type=str, help='Directory to hold memory-mapped trajectory chunks')
+    parser_run.add_argument('--socketdir', '-s', type=str, default='tmp/sock', help='Directory to hold sockets, or tcp://host:port to listen on the network')
     parser_run.add_argument('--daemonize', '-d', action='store_true', default=False, help='Daemonize (background) the process')
     parser_run.add_argument('--wallclock-limit', '-W', type=float, default=None, help='Maximum time to run in seconds')
     parser_run.add_argument('--timestep-limit', '-T', type=int, default=None, help='Maximum time to run in timesteps')
     parser_run.add_argument('--discrete-actions', '-D', action='store_true', help='Use a discrete action space')
+    parser_run.add_argument('--framing', type=str, default='json', choices=grs.Bridge.FRAMINGS, help='Wire framing for step messages')
+    parser_run.add_argument('--ob-slots', type=int, default=1, help='Number of observation buffers to rotate through')
+    parser_run.add_argument('--wakeup', type=str, default='socket', choices=grs.Bridge.WAKEUPS, help='How each side is woken for a new step')
+    parser_run.add_argument('--spin-us', type=float, default=0, help='Microseconds to spin on the control block before blocking')
+    parser_run.add_argument('--compression', type=str, default=None, choices=grs.Bridge.COMPRESSIONS, help='Compress observations sent over TCP')
+    parser_run.add_argument('--memory', type=str, default='file', choices=grs.Bridge.MEMORIES, help='Back shared observations with files in the socket directory or anonymous memory')
+    parser_run.add_argument('--ob-history', type=int, default=0, help='Keep this many recent observations in shared memory for frame stacking')
+    parser_run.add_argument('--max-sequence', type=int, default=0, help='Let agents send up to this many actions per round trip')
+    parser_run.add_argument('--allow-preprocess', action='store_true', help='Let agents ask for observations to be preprocessed before they are sent')
+    parser_run.add_argument('--max-states', type=int, default=0, help='Let agents save up to this many emulator states and restore them')
+    parser_run.add_argument('--restore-cost', type=int, default=1, help='Timesteps each state restore counts for')
+    parser_run.add_argument('--max-forks', type=int, default=0, help='Let agents fork up to this many copies of the server to roll out from its current state')
+    parser_run.add_argument('--stats', action='store_true', help='Record Bridge timings and write them to bridge.json in the monitor directory (needs --monitordir)')
+    parser_run.add_argument('--num-envs', type=int, default=1, help='Serve a batch of this many emulators, each in its own worker process')
+    parser_run.add_argument('--fast-reset', action='store_true', help='Reset by restoring an in-memory snapshot of the start state (ignored with --bk2dir)')
+    parser_run.add_argument('--persistent', action='store_true', help='Keep serving when an agent disconnects, so another can pick up where it left off')
+    parser_run.add_argument('--keyframe-interval', type=int, default=0, help='Send observations over TCP as deltas, with a full frame this often')
 
     parser_list.set_defaults(func=lambda args: parser_list.print_help())
     subparsers_list = parser_list.add_subparsers()
@@ -95,6 +167,9 @@ def main(argv=sys.argv[1:]):
     parser_list_states.add_argument('game', type=str, default=None, nargs='*', help='List for specified games only')
 
     args = parser.parse_args(argv)
+    if args.func is run_args and args.stats and not args.monitordir:
+        # Stats are written next to the monitor files
+        parser_run.error('--stats needs --monitordir')
     if args.data_dir:
         retro.data.path(args.data_dir)
     args.func(args)
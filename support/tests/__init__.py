@@ -1,8 +1,8 @@
-import multiprocessing
 import pytest
 import tempfile
-from gym_remote.client import RemoteEnv
-from gym_remote.server import RemoteEnvWrapper
+from gym_remote.client import RemoteEnv, VecRemoteEnv
+from gym_remote.server import RemoteEnvWrapper, VecRemoteEnvWrapper, ProcessVecRemoteEnvWrapper
+from gym_remote.testing import run_wrapper
 
 
 @pytest.fixture(scope='function')
@@ -13,26 +13,20 @@ def tempdir():
 
 @pytest.fixture(scope='function')
 def process_wrapper():
-    with tempfile.TemporaryDirectory() as dir:
-        def serve(pipe):
-            make_env = pipe.recv()
-            env = RemoteEnvWrapper(make_env(), dir)
-            pipe.send('ok')
-
-            args = pipe.recv()
-            kwargs = pipe.recv()
-            env.serve(*args, **kwargs)
-
-        parent_pipe, child_pipe = multiprocessing.Pipe()
-        proc = multiprocessing.Process(target=serve, args=(child_pipe,))
-        proc.start()
-
-        def call(env, *args, **kwargs):
-            parent_pipe.send(env)
-            assert parent_pipe.recv() == 'ok'
-            parent_pipe.send(args)
-            parent_pipe.send(kwargs)
-            return RemoteEnv(dir)
-
-        yield call
-        proc.terminate()
+    def make_wrapper(make_env, dir, **kwargs):
+        return RemoteEnvWrapper(make_env(), dir, **kwargs)
+    yield from run_wrapper(make_wrapper, RemoteEnv)
+
+
+@pytest.fixture(scope='function')
+def process_vec_wrapper():
+    def make_wrapper(make_env, dir, num_envs=2, **kwargs):
+        return VecRemoteEnvWrapper([make_env() for _ in range(num_envs)], dir, **kwargs)
+    yield from run_wrapper(make_wrapper, VecRemoteEnv)
+
+
+@pytest.fixture(scope='function')
+def process_pool_wrapper():
+    def make_wrapper(make_env, dir, num_envs=2, **kwargs):
+        return ProcessVecRemoteEnvWrapper(make_env, num_envs, dir, **kwargs)
+    yield from run_wrapper(make_wrapper, VecRemoteEnv)
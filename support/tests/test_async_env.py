@@ -0,0 +1,61 @@
+import asyncio
+import os
+import tempfile
+import threading
+from gym_remote.client import AsyncRemoteEnv
+from gym_remote.server import RemoteEnvWrapper
+
+from .test_env import BitEnv, StepEnv
+
+
+def serve_threads(make_env, base, n):
+    threads = []
+    for i in range(n):
+        directory = os.path.join(base, str(i))
+        os.makedirs(directory)
+        env = RemoteEnvWrapper(make_env(), directory)
+        thread = threading.Thread(target=env.serve, daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def test_async_step():
+    with tempfile.TemporaryDirectory() as base:
+        serve_threads(StepEnv, base, 1)
+
+        async def run():
+            env = await AsyncRemoteEnv.connect(os.path.join(base, '0'))
+            assert await env.reset() == 0
+            assert await env.step(0) == (0, 1, False, {})
+            assert await env.step(1) == (0, 2, True, {})
+            assert await env.reset() == 0
+            env.close()
+
+        asyncio.run(run())
+
+
+def test_async_multiplex():
+    n = 8
+    with tempfile.TemporaryDirectory() as base:
+        threads = serve_threads(BitEnv, base, n)
+
+        async def run(i):
+            env = await AsyncRemoteEnv.connect(os.path.join(base, str(i)))
+            results = []
+            for j in range(16):
+                results.append(await env.step((i + j) % 8))
+            env.close()
+            return results
+
+        async def run_all():
+            return await asyncio.gather(*[run(i) for i in range(n)])
+
+        results = asyncio.run(run_all())
+        for i, steps in enumerate(results):
+            for j, step in enumerate(steps):
+                action = (i + j) % 8
+                assert step == (action & 1, float(action & 2), bool(action & 4), {})
+        for thread in threads:
+            thread.join(1)
+            assert not thread.is_alive()
@@ -4,8 +4,8 @@ import os
 from . import tempdir
 
 
-def setup_client_server(base):
-    server = gr.Bridge(base)
+def setup_client_server(base, **kwargs):
+    server = gr.Bridge(base, **kwargs)
     server.listen()
 
     client = gr.Bridge(base)
@@ -131,6 +131,28 @@ def test_bridge_int_fold(tempdir):
     assert (client._channels['int_fold'].value == [0, 1]).all()
 
 
+def test_int_fold_table():
+    import numpy as np
+    channel = gr.IntFoldChannel((2, 3, 4), np.uint8)
+    assert channel._rows is not None
+
+    for value in ([1, 2, 3], np.array([1, 2, 3], np.int64), [1.0, 2.0, 3.0], [3, 5, -1], [1.5, 2, 3]):
+        assert channel.parse(value) == channel._fold(np.asarray(value))
+    for code in range(24):
+        assert (channel.unparse(code) == channel._unfold(code)).all()
+
+    channel.value = [1, 2, 3]
+    assert channel.value is channel.unparse(channel.parse([1, 2, 3]))
+    assert not channel.value.flags.writeable
+
+    # Dtypes that cannot hold every row exactly match the arithmetic path
+    channel = gr.IntFoldChannel((3,), np.int8)
+    assert channel.parse(np.array([True])) == channel._fold(np.array([True])) == 1
+    channel = gr.IntFoldChannel((200,), np.uint8)
+    for value in (np.array([-56], np.int8), np.array([100], np.int8)):
+        assert channel.parse(value) == channel._fold(value)
+
+
 def test_bridge_np(tempdir):
     import numpy as np
     client, server = setup_client_server(tempdir)
@@ -407,3 +429,599 @@ def test_bridge_exception_client(tempdir):
         assert False, 'No exception'
     except gr.exceptions.GymRemoteError:
         pass
+
+
+def test_bridge_binary_framing(tempdir):
+    client, server = setup_client_server(tempdir, framing='binary')
+    server.add_channel('int', gr.IntChannel())
+    server.add_channel('float', gr.FloatChannel())
+    server.add_channel('bool', gr.BoolChannel())
+    server.add_channel('int_fold', gr.IntFoldChannel((2, 3)))
+
+    start_bridge(client, server)
+
+    assert client.framing == 'binary'
+
+    server._channels['int'].value = -3
+    server._channels['float'].value = 0.5
+    server._channels['bool'].value = True
+    server._channels['int_fold'].value = [1, 2]
+    server.send()
+    client.recv()
+
+    assert client._channels['int'].value == -3
+    assert client._channels['float'].value == 0.5
+    assert client._channels['bool'].value is True
+    assert (client._channels['int_fold'].value == [1, 2]).all()
+
+    client._channels['bool'].value = False
+    client.send()
+    server.recv()
+
+    assert server._channels['int'].value == -3
+    assert server._channels['bool'].value is False
+
+
+def test_bridge_binary_record_limit(tempdir):
+    client, server = setup_client_server(tempdir, framing='binary')
+    for i in range(65):
+        server.add_channel('int%d' % i, gr.IntChannel())
+
+    start_bridge(client, server)
+
+    server._channels['int0'].value = 1
+    try:
+        server.send()
+        assert False, 'No exception'
+    except ValueError:
+        pass
+
+
+def test_bridge_bad_framing(tempdir):
+    import gc
+    import sys
+    unraisable = []
+    hook, sys.unraisablehook = sys.unraisablehook, unraisable.append
+    try:
+        try:
+            gr.Bridge(tempdir, framing='morse')
+            assert False, 'No exception'
+        except ValueError:
+            pass
+        gc.collect()
+    finally:
+        sys.unraisablehook = hook
+    # The half built bridge is dropped without errors
+    assert not unraisable
+
+
+def test_bridge_binary_np(tempdir):
+    import numpy as np
+    client, server = setup_client_server(tempdir, framing='binary')
+    server.add_channel('np', gr.NpChannel((2, 2), int))
+
+    start_bridge(client, server)
+
+    server._channels['np'].value = np.ones((2, 2), int)
+    server.send()
+    client.recv()
+
+    assert (client._channels['np'].value == np.ones((2, 2))).all()
+
+
+def test_bridge_binary_buffered(tempdir):
+    client, server = setup_client_server(tempdir, framing='binary')
+    server.add_channel('int', gr.IntChannel())
+
+    start_bridge(client, server)
+
+    for i in range(3):
+        server._channels['int'].value = i
+        server.send()
+    for i in range(3):
+        client.recv()
+        assert client._channels['int'].value == i
+
+
+def test_bridge_binary_exception(tempdir):
+    client, server = setup_client_server(tempdir, framing='binary')
+
+    start_bridge(client, server)
+
+    server.exception(gr.exceptions.GymRemoteError, 'binary')
+    try:
+        client.recv()
+        assert False, 'No exception'
+    except gr.exceptions.GymRemoteError as e:
+        assert str(e) == 'binary'
+
+
+def test_bridge_binary_close(tempdir):
+    client, server = setup_client_server(tempdir, framing='binary')
+    server.add_channel('np', gr.NpChannel((2, 2), int))
+
+    start_bridge(client, server)
+
+    server.close('disconnect')
+    try:
+        client.recv()
+        assert False, 'No exception'
+    except gr.Bridge.Closed as e:
+        assert str(e) == 'disconnect'
+
+    assert not os.path.exists(os.path.join(tempdir, 'sock'))
+    assert not os.path.exists(os.path.join(tempdir, 'np'))
+
+
+def test_bridge_binary_pipelined_handshake(tempdir):
+    client, server = setup_client_server(tempdir, framing='binary')
+    server.add_channel('int', gr.IntChannel())
+
+    server.server_accept()
+    # A form feed inside the first frame must survive the JSON handshake
+    server._channels['int'].value = ord('\f')
+    server.send()
+    client.configure_client()
+    client.recv()
+
+    assert client._channels['int'].value == ord('\f')
+
+
+def test_bridge_large_message(tempdir):
+    client, server = setup_client_server(tempdir)
+    channel = server.add_channel('int', gr.IntChannel())
+    channel.annotate('padding', 'x' * 3 * gr.Bridge.BUFFER_SIZE)
+
+    start_bridge(client, server)
+
+    assert client._channels['int'].annotations == channel.annotations
+
+
+def test_bridge_backlog(tempdir):
+    for framing in gr.Bridge.FRAMINGS:
+        client, server = setup_client_server(tempdir, framing=framing)
+        server.add_channel('float', gr.FloatChannel())
+
+        start_bridge(client, server)
+
+        for i in range(100):
+            server._channels['float'].value = i / 3
+            server.send()
+        for i in range(100):
+            client.recv()
+            assert client._channels['float'].value == i / 3
+
+        client.close()
+        server.close()
+
+
+def test_bridge_recv_steady_state(tempdir):
+    import tracemalloc
+    client, server = setup_client_server(tempdir, framing='binary')
+    server.add_channel('reward', gr.FloatChannel())
+    server.add_channel('done', gr.BoolChannel())
+
+    start_bridge(client, server)
+
+    def step(n):
+        for i in range(n):
+            server._channels['reward'].value = i
+            server._channels['done'].value = False
+            server.send()
+            client.recv()
+
+    step(1000)
+    buffer = client._buffer
+    tracemalloc.start()
+    try:
+        step(1000)
+        before = tracemalloc.get_traced_memory()[0]
+        step(20000)
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    assert client._buffer is buffer
+    assert after - before < 1024
+
+
+def test_bridge_np_slots(tempdir):
+    import numpy as np
+    client, server = setup_client_server(tempdir, framing='binary')
+    server.add_channel('np', gr.NpChannel((2, 2), int, 3))
+
+    start_bridge(client, server)
+
+    assert client._channels['np'].slots == 3
+
+    values = []
+    for i in range(5):
+        server._channels['np'].value = np.full((2, 2), i, int)
+        server.send()
+        client.recv()
+        values.append(client._channels['np'].value)
+        assert (values[-1] == i).all()
+        # The previous two values have not been overwritten yet
+        for j, value in enumerate(values[-3:]):
+            assert (value == i - len(values[-3:]) + j + 1).all()
+
+
+def test_bridge_np_history(tempdir):
+    import numpy as np
+    client, server = setup_client_server(tempdir)
+    server.add_channel('np', gr.NpChannel((2,), int, 1, 3))
+
+    start_bridge(client, server)
+
+    channel = client._channels['np']
+    assert channel.history == 3
+    server._channels['np'].value = [1, 1]
+    server.send()
+    client.recv()
+    channel.fill_history()
+    assert channel.history_view().tolist() == [[1, 1]] * 3
+
+    views = []
+    for i in range(2, 7):
+        server._channels['np'].value = [i, i]
+        server.send()
+        client.recv()
+        views.append(channel.history_view())
+        assert views[-1][:, 0].tolist() == [max(i - 2, 1), max(i - 1, 1), i]
+    # Views share memory with the ring instead of copying it
+    assert np.shares_memory(views[-1], channel._slots)
+
+
+def test_bridge_eventfd(tempdir):
+    import numpy as np
+    client, server = setup_client_server(tempdir, wakeup='eventfd')
+    server.add_channel('int', gr.IntChannel())
+    server.add_channel('float', gr.FloatChannel())
+    server.add_channel('bool', gr.BoolChannel())
+    server.add_channel('int_fold', gr.IntFoldChannel((2, 3)))
+    server.add_channel('np', gr.NpChannel((2, 2), int))
+
+    start_bridge(client, server)
+
+    assert client.wakeup == 'eventfd'
+    assert os.path.exists(os.path.join(tempdir, 'ctl'))
+
+    server._channels['int'].value = -3
+    server._channels['float'].value = 0.5
+    server._channels['np'].value = np.ones((2, 2), int)
+    server.send()
+    client.recv()
+
+    assert client._channels['int'].value == -3
+    assert client._channels['float'].value == 0.5
+    assert client._channels['bool'].value is None
+    assert (client._channels['np'].value == 1).all()
+
+    client._channels['bool'].value = True
+    client._channels['int_fold'].value = [1, 2]
+    client.send()
+    server.recv()
+
+    assert server._channels['bool'].value is True
+    assert (server._channels['int_fold'].value == [1, 2]).all()
+    assert server._channels['int'].value == -3
+
+    # Updates that pile up are coalesced into the latest one
+    for i in range(3):
+        server._channels['int'].value = i
+        server.send()
+    client.recv()
+    assert client._channels['int'].value == 2
+
+    client.close('disconnect')
+    try:
+        server.recv()
+        assert False, 'No exception'
+    except gr.Bridge.Closed as e:
+        assert str(e) == 'disconnect'
+
+    assert not os.path.exists(os.path.join(tempdir, 'sock'))
+    assert not os.path.exists(os.path.join(tempdir, 'ctl'))
+
+
+def test_bridge_memfd(tempdir):
+    import numpy as np
+    for wakeup in gr.Bridge.WAKEUPS:
+        client, server = setup_client_server(tempdir, wakeup=wakeup, memory='memfd')
+        server.add_channel('int', gr.IntChannel())
+        server.add_channel('np', gr.NpChannel((2, 2), int, 2))
+
+        start_bridge(client, server)
+
+        # Nothing but the socket lives in the directory
+        assert os.listdir(tempdir) == ['sock']
+        assert client.memory == 'memfd'
+
+        server._channels['np'].value = np.ones((2, 2), int)
+        server._channels['int'].value = 3
+        server.send()
+        client.recv()
+
+        assert (client._channels['np'].value == 1).all()
+        assert client._channels['int'].value == 3
+
+        client._channels['np'].value = np.full((2, 2), 2, int)
+        client.send()
+        server.recv()
+
+        assert (server._channels['np'].value == 2).all()
+
+        client.close()
+        server.close()
+
+
+def test_bridge_hugetlb(tempdir):
+    import numpy as np
+    import pytest
+    client, server = setup_client_server(tempdir, memory='hugetlb')
+    try:
+        server.add_channel('np', gr.NpChannel((224, 320, 3), np.uint8))
+    except OSError:
+        server.close()
+        pytest.skip('No huge pages are available')
+
+    start_bridge(client, server)
+
+    server._channels['np'].value = np.full((224, 320, 3), 7, np.uint8)
+    server.send()
+    client.recv()
+
+    assert (client._channels['np'].value == 7).all()
+
+
+def test_bridge_eventfd_exception(tempdir):
+    client, server = setup_client_server(tempdir, wakeup='eventfd')
+    server.add_channel('int', gr.IntChannel())
+
+    start_bridge(client, server)
+
+    server.exception(gr.exceptions.GymRemoteError)
+    server._channels['int'].value = 1
+    server.send()
+    try:
+        client.recv()
+        assert False, 'No exception'
+    except gr.exceptions.GymRemoteError:
+        pass
+    client.recv()
+    assert client._channels['int'].value == 1
+
+
+def test_bridge_eventfd_timeout(tempdir):
+    client, server = setup_client_server(tempdir, wakeup='eventfd')
+
+    start_bridge(client, server)
+
+    server.settimeout(0.01)
+    try:
+        server.recv()
+        assert False, 'No exception'
+    except gr.Bridge.Timeout:
+        pass
+
+
+def test_bridge_eventfd_spin(tempdir):
+    client, server = setup_client_server(tempdir, wakeup='eventfd')
+    server.add_channel('int', gr.IntChannel())
+
+    start_bridge(client, server)
+    client.spin_us = 100
+
+    assert client.spin_hit_ratio is None
+
+    server._channels['int'].value = 1
+    server.send()
+    client.recv()
+
+    assert client._channels['int'].value == 1
+    assert client.spin_hits == 1
+    assert client.spin_misses == 0
+
+    client.settimeout(0.01)
+    try:
+        client.recv()
+        assert False, 'No exception'
+    except gr.Bridge.Timeout:
+        pass
+
+    assert client.spin_misses == 1
+    assert client.spin_hit_ratio == 0.5
+
+
+def test_bridge_async(tempdir):
+    import asyncio
+    server = gr.Bridge(tempdir, framing='binary')
+    server.add_channel('int', gr.IntChannel())
+    server.add_channel('bool', gr.BoolChannel())
+    server.listen()
+    client = gr.AsyncBridge(tempdir)
+
+    async def run():
+        await client.connect()
+        server.server_accept()
+        await client.configure_client()
+
+        assert client.framing == 'binary'
+
+        server._channels['int'].value = 1
+        server.send()
+        await client.recv()
+        assert client._channels['int'].value == 1
+
+        client._channels['bool'].value = True
+        await client.send()
+        server.recv()
+        assert server._channels['bool'].value is True
+
+        server.exception(gr.exceptions.GymRemoteError)
+        try:
+            await client.recv()
+            assert False, 'No exception'
+        except gr.exceptions.GymRemoteError:
+            pass
+
+        client.close('disconnect')
+        try:
+            server.recv()
+            assert False, 'No exception'
+        except gr.Bridge.Closed as e:
+            assert str(e) == 'disconnect'
+
+    asyncio.run(run())
+    assert not os.path.exists(os.path.join(tempdir, 'sock'))
+
+
+def setup_tcp_client_server(**kwargs):
+    server = gr.Bridge('tcp://127.0.0.1:0', **kwargs)
+    server.listen()
+
+    client = gr.Bridge('tcp://%s:%d' % server.address)
+    client.connect()
+    return client, server
+
+
+def test_bridge_tcp():
+    import numpy as np
+    for framing in gr.Bridge.FRAMINGS:
+        for compression in (None, 'zlib'):
+            client, server = setup_tcp_client_server(framing=framing, compression=compression)
+            server.add_channel('int_fold', gr.IntFoldChannel((2, 3)))
+            server.add_channel('float', gr.FloatChannel())
+            server.add_channel('np', gr.NpChannel((4, 3), np.dtype('>u2')))
+
+            start_bridge(client, server)
+
+            assert client.compression == compression
+            assert client._channels['np'].dtype == np.dtype('>u2')
+
+            value = np.arange(12, dtype='>u2').reshape(4, 3)
+            server._channels['np'].value = value
+            server._channels['float'].value = 0.5
+            server.send()
+            client.recv()
+
+            assert (client._channels['np'].value == value).all()
+            assert client._channels['float'].value == 0.5
+
+            client._channels['int_fold'].value = [1, 2]
+            client._channels['np'].value = value * 2
+            client.send()
+            server.recv()
+
+            assert (server._channels['int_fold'].value == [1, 2]).all()
+            assert (server._channels['np'].value == value * 2).all()
+
+            client.close('disconnect')
+            try:
+                server.recv()
+                assert False, 'No exception'
+            except gr.Bridge.Closed as e:
+                assert str(e) == 'disconnect'
+
+
+def test_bridge_tcp_slots():
+    import numpy as np
+    client, server = setup_tcp_client_server(framing='binary')
+    server.add_channel('np', gr.NpChannel((2,), int, 2))
+
+    start_bridge(client, server)
+
+    server._channels['np'].value = [1, 1]
+    server.send()
+    client.recv()
+    first = client._channels['np'].value
+    server._channels['np'].value = [2, 2]
+    server.send()
+    client.recv()
+
+    assert (first == 1).all()
+    assert (client._channels['np'].value == 2).all()
+
+
+def test_bridge_tcp_delta():
+    import numpy as np
+    for framing in gr.Bridge.FRAMINGS:
+        for compression in (None, 'zlib'):
+            client, server = setup_tcp_client_server(framing=framing, compression=compression, keyframe_interval=3)
+            server.add_channel('np', gr.NpChannel((4, 3), np.uint8, 2))
+
+            start_bridge(client, server)
+
+            assert client.keyframe_interval == 3
+
+            for i in range(7):
+                value = np.full((4, 3), i, np.uint8)
+                value[i % 4] = 255
+                server._channels['np'].value = value
+                server.send()
+                client.recv()
+                assert (client._channels['np'].value == value).all()
+
+            client.close()
+            server.close()
+
+
+def test_np_channel_delta():
+    import numpy as np
+    sender = gr.NpChannel((2, 2), np.int16)
+    receiver = gr.NpChannel((2, 2), np.int16)
+    sender.set_base(None)
+    receiver.set_base(None)
+
+    kinds = []
+    for i in range(5):
+        sender.value = [[i, 0], [0, -i]]
+        data = bytes(sender.encode(None, 2))
+        kinds.append(data[:1])
+        receiver.decode(data, None, 2)
+        assert (receiver.value == [[i, 0], [0, -i]]).all()
+
+    assert kinds == [b'\x00', b'\x01', b'\x00', b'\x01', b'\x00']
+
+
+def test_bridge_stats(tempdir):
+    import json
+    for wakeup in gr.Bridge.WAKEUPS:
+        path = os.path.join(tempdir, 'stats.json')
+        client, server = setup_client_server(tempdir, wakeup=wakeup, stats_path=path)
+        client._stats = gr.Stats()
+        server.add_channel('int', gr.IntChannel())
+
+        start_bridge(client, server)
+
+        for i in range(5):
+            client._channels['int'].value = i
+            client.send()
+            server.recv()
+            server.send()
+            client.recv()
+
+        stats = client.stats()
+        assert stats['counters']['sent.update'] == 5
+        assert stats['counters']['received.update'] == 5
+        assert stats['timers']['recv']['count'] == 5
+        assert stats['timers']['handshake']['count'] == 1
+        assert stats['timers']['recv']['p99'] >= stats['timers']['recv']['p50'] > 0
+
+        client.close()
+        server.close()
+
+        with open(path) as f:
+            stats = json.load(f)
+        assert stats['counters']['received.update'] == 5
+        assert stats['counters']['sent.description'] == 1
+        assert stats['counters']['bytes_sent'] > 0
+        assert stats['counters']['bytes_received'] > 0
+        assert stats['timers']['blocked']['count'] >= 5
+        os.unlink(path)
+
+
+def test_bridge_no_stats(tempdir):
+    client, server = setup_client_server(tempdir)
+    assert client.stats() is None
+    assert server.stats() is None
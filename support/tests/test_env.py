@@ -6,59 +6,61 @@ import numpy as np
 import os
 import time
 
-from . import process_wrapper
+from gym_remote.client import RemoteEnv
+from gym_remote.server import serve
+from gym_remote.testing import BitEnv, MultiBitEnv, StepEnv
+from . import process_wrapper, tempdir
 
 
-class BitEnv(gym.Env):
+class BoxEnv(gym.Env):
     def __init__(self):
-        self.action_space = gym.spaces.Discrete(8)
-        self.observation_space = gym.spaces.Discrete(2)
+        self.action_space = gym.spaces.Discrete(256)
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(2, 2), dtype=np.uint8)
 
     def step(self, action):
-        assert self.action_space.contains(action)
-        observation = action & 1
-        reward = float(action & 2)
-        done = bool(action & 4)
-        return observation, reward, done, {}
+        return np.full((2, 2), action, np.uint8), 0.0, False, {}
 
     def reset(self):
-        return 0
+        return np.zeros((2, 2), np.uint8)
 
 
-class MultiBitEnv(gym.Env):
+class CounterEnv(gym.Env):
     def __init__(self):
-        self.action_space = gym.spaces.MultiBinary(3)
-        self.observation_space = gym.spaces.Discrete(2)
+        self.action_space = gym.spaces.Discrete(256)
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(2, 2), dtype=np.uint8)
+        self.count = 0
 
     def step(self, action):
-        assert self.action_space.contains(action)
-        observation = action[0]
-        reward = float(action[1])
-        done = bool(action[2])
-        return observation, reward, done, {}
+        self.count += action
+        return np.full((2, 2), self.count, np.uint8), float(action), False, {}
 
     def reset(self):
-        return 0
+        self.count = 0
+        return np.zeros((2, 2), np.uint8)
 
+    def get_state(self):
+        return self.count
 
-class StepEnv(gym.Env):
+    def set_state(self, state):
+        self.count = state
+
+
+class SlowEnv(CounterEnv):
+    def step(self, action):
+        time.sleep(0.2)
+        return super(SlowEnv, self).step(action)
+
+
+class FrameEnv(gym.Env):
     def __init__(self):
-        self.action_space = gym.spaces.Discrete(2)
-        self.observation_space = gym.spaces.Discrete(1)
-        self.reward = 0
-        self.done = False
+        self.action_space = gym.spaces.Discrete(256)
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(4, 4, 3), dtype=np.uint8)
 
     def step(self, action):
-        if not self.done:
-            self.reward += 1
-        if action:
-            self.done = True
-        return 0, self.reward, self.done, {}
+        return np.full((4, 4, 3), action, np.uint8), 0.0, False, {}
 
     def reset(self):
-        self.reward = 0
-        self.done = False
-        return 0
+        return np.zeros((4, 4, 3), np.uint8)
 
 
 def test_split(process_wrapper):
@@ -96,6 +98,20 @@ def test_reset(process_wrapper):
     assert env.step(0) == (0, 3, True, {})
 
 
+def test_step_async(process_wrapper):
+    env = process_wrapper(StepEnv)
+
+    env.reset_async()
+    assert env.reset_wait() == 0
+    env.step_async(0)
+    assert env.step_wait() == (0, 1, False, {})
+    env.step_async(1)
+    assert env.step_wait() == (0, 2, True, {})
+    env.reset_async()
+    assert env.reset_wait() == 0
+    assert env.step(0) == (0, 1, False, {})
+
+
 def test_reset_exception(process_wrapper):
     env = process_wrapper(StepEnv, ignore_reset=True)
 
@@ -133,6 +149,47 @@ def test_ts_limit(process_wrapper):
     assert False, 'Remote did not shut down'
 
 
+def test_step_sequence(process_wrapper):
+    env = process_wrapper(StepEnv, wrapper_kwargs={'max_sequence': 4})
+
+    assert env.reset() == 0
+    assert env.step_sequence([0, 0, 0]) == (0, [1, 2, 3], False, 3)
+    assert env.step(0) == (0, 4, False, {})
+    # Sequences stop at the end of an episode
+    assert env.step_sequence([0, 1, 0]) == (0, [5, 6], True, 2)
+    assert env.reset() == 0
+    # Sequences longer than max_sequence take several round trips
+    assert env.step_sequence([0] * 10) == (0, list(range(1, 11)), False, 10)
+
+
+def test_step_sequence_multibinary(process_wrapper):
+    env = process_wrapper(MultiBitEnv, wrapper_kwargs={'max_sequence': 2})
+
+    ob, rewards, done, steps = env.step_sequence([[1, 1, 0], [0, 0, 0], [0, 1, 1]])
+    assert (ob, rewards, done, steps) == (0, [1, 0, 1], True, 3)
+
+
+def test_step_sequence_fallback(process_wrapper):
+    env = process_wrapper(StepEnv)
+
+    assert env.step_sequence([0, 0, 1, 0]) == (0, [1, 2, 3], True, 3)
+
+
+def test_step_sequence_ts_limit(process_wrapper):
+    env = process_wrapper(StepEnv, timestep_limit=5, wrapper_kwargs={'max_sequence': 4})
+
+    assert env.step_sequence([0, 0, 0]) == (0, [1, 2, 3], False, 3)
+    # Only the timesteps left are run
+    assert env.step_sequence([0, 0, 0]) == (0, [4, 5], False, 2)
+    try:
+        env.step(0)
+    except gre.TimestepTimeoutError:
+        return
+    except:
+        assert False, 'Incorrect exception'
+    assert False, 'Remote did not shut down'
+
+
 def test_wc_limit(process_wrapper):
     env = process_wrapper(StepEnv, wallclock_limit=0.1)
 
@@ -156,3 +213,335 @@ def test_cleanup(process_wrapper):
     time.sleep(0.1)
 
     assert not os.path.exists(os.path.join(env.bridge.base, 'sock'))
+
+
+def test_ob_slots(process_wrapper):
+    env = process_wrapper(BoxEnv, wrapper_kwargs={'ob_slots': 2})
+
+    ob = env.reset()
+    assert (ob == 0).all()
+    ob1 = env.step(1)[0]
+    ob2 = env.step(2)[0]
+    assert (ob1 == 1).all()
+    assert (ob2 == 2).all()
+    ob3 = env.step(3)[0]
+    assert (ob2 == 2).all()
+    assert (ob3 == 3).all()
+
+
+def test_spin(process_wrapper):
+    env = process_wrapper(BitEnv, wrapper_kwargs={'wakeup': 'eventfd', 'spin_us': 1000})
+    env.bridge.spin_us = 1000
+
+    for i in range(100):
+        assert env.step(i % 8) == (i & 1, float(i & 2), bool(i & 4), {})
+    assert env.bridge.spin_hits + env.bridge.spin_misses == 100
+
+
+def test_eventfd(process_wrapper):
+    env = process_wrapper(StepEnv, timestep_limit=4, wrapper_kwargs={'wakeup': 'eventfd'})
+
+    assert env.reset() == 0
+    assert env.step(0) == (0, 1, False, {})
+    assert env.step(1) == (0, 2, True, {})
+    assert env.reset() == 0
+    try:
+        env.step(0)
+    except gre.TimestepTimeoutError:
+        return
+    except:
+        assert False, 'Incorrect exception'
+    assert False, 'Remote did not shut down'
+
+
+def test_memfd(process_wrapper):
+    env = process_wrapper(BoxEnv, wrapper_kwargs={'memory': 'memfd', 'wakeup': 'eventfd', 'ob_slots': 2})
+
+    assert (env.reset() == 0).all()
+    assert (env.step(5)[0] == 5).all()
+    assert (env.step(6)[0] == 6).all()
+
+
+PREPROCESS = [['grayscale'], ['downsample', 2], ['stack', 2]]
+
+
+def test_preprocess(process_wrapper):
+    env = process_wrapper(FrameEnv, wrapper_kwargs={'allow_preprocess': True, 'max_sequence': 4},
+                          client_kwargs={'preprocess': PREPROCESS})
+
+    assert 'preprocess' in env.ch_ob.annotations
+    assert env.observation_space.shape == (2, 2, 2)
+    assert (env.reset() == 0).all()
+    ob = env.step(10)[0]
+    assert (ob[:, :, 0] == 0).all() and (ob[:, :, 1] == 10).all()
+    ob = env.step_sequence([20, 30])[0]
+    assert (ob[:, :, 0] == 20).all() and (ob[:, :, 1] == 30).all()
+
+
+def test_preprocess_fallback(process_wrapper):
+    env = process_wrapper(FrameEnv, client_kwargs={'preprocess': PREPROCESS})
+
+    assert env.preprocessor is not None
+    assert env.observation_space.shape == (2, 2, 2)
+    assert (env.reset() == 0).all()
+    ob = env.step(10)[0]
+    assert (ob[:, :, 0] == 0).all() and (ob[:, :, 1] == 10).all()
+    # Later steps leave observations the agent kept alone
+    env.step(20)
+    assert (ob[:, :, 0] == 0).all() and (ob[:, :, 1] == 10).all()
+
+
+def test_preprocess_bad_request(process_wrapper):
+    try:
+        process_wrapper(FrameEnv, wrapper_kwargs={'allow_preprocess': True}, client_kwargs={'preprocess': [['rotate', 90]]})
+    except gre.RequestError:
+        return
+    assert False, 'No exception'
+
+
+def test_preprocess_malformed_request(process_wrapper):
+    # Malformed specs are refused instead of stopping the server
+    try:
+        process_wrapper(FrameEnv, wrapper_kwargs={'allow_preprocess': True}, client_kwargs={'preprocess': [[['x']]]})
+    except gre.RequestError:
+        return
+    assert False, 'No exception'
+
+
+def test_ob_history(process_wrapper):
+    env = process_wrapper(BoxEnv, wrapper_kwargs={'ob_history': 3})
+
+    assert (env.reset() == 0).all()
+    assert env.history().shape == (3, 2, 2)
+    assert (env.history() == 0).all()
+    env.step(1)
+    env.step(2)
+    assert env.history()[:, 0, 0].tolist() == [0, 1, 2]
+    env.step(3)
+    assert env.history()[:, 0, 0].tolist() == [1, 2, 3]
+    env.reset()
+    assert env.history()[:, 0, 0].tolist() == [0, 0, 0]
+
+
+def test_ob_history_sequence(process_wrapper):
+    env = process_wrapper(BoxEnv, wrapper_kwargs={'ob_history': 3, 'max_sequence': 4})
+
+    env.reset()
+    env.step_sequence([1, 2, 3])
+    assert env.history()[:, 0, 0].tolist() == [1, 2, 3]
+    env.step_sequence([4, 5])
+    assert env.history()[:, 0, 0].tolist() == [3, 4, 5]
+
+
+def test_save_restore_state(process_wrapper):
+    env = process_wrapper(CounterEnv, wrapper_kwargs={'max_states': 2})
+
+    env.reset()
+    env.step(1)
+    first = env.save_state()
+    env.step(2)
+    second = env.save_state()
+    assert env.step(4)[0][0, 0] == 7
+    assert (env.restore_state(first) == 1).all()
+    assert env.step(1)[0][0, 0] == 2
+    assert (env.restore_state(second) == 3).all()
+
+    # The least recently restored state is dropped first
+    third = env.save_state()
+    assert len({first, second, third}) == 3
+    try:
+        env.restore_state(first)
+        assert False, 'No exception'
+    except gre.StateError:
+        pass
+    assert (env.restore_state(second) == 3).all()
+    assert (env.restore_state(third) == 3).all()
+
+    # Refused restores leave the env as it was
+    try:
+        env.restore_state(99)
+        assert False, 'No exception'
+    except gre.StateError:
+        pass
+    assert env.step(1)[0][0, 0] == 4
+    assert env.step(1)[0][0, 0] == 5
+
+
+def test_restore_cost(process_wrapper):
+    env = process_wrapper(CounterEnv, wrapper_kwargs={'max_states': 1, 'restore_cost': 2}, timestep_limit=4)
+
+    env.reset()
+    state = env.save_state()
+    env.step(1)
+    env.restore_state(state)
+    try:
+        env.step(1)
+    except gre.TimestepTimeoutError:
+        return
+    except:
+        assert False, 'Incorrect exception'
+    assert False, 'Remote did not shut down'
+
+
+def test_save_state_unsupported(process_wrapper):
+    env = process_wrapper(CounterEnv)
+    try:
+        env.save_state()
+        assert False, 'No exception'
+    except NotImplementedError:
+        pass
+
+
+def test_fork(process_wrapper):
+    env = process_wrapper(CounterEnv, wrapper_kwargs={'max_forks': 2})
+
+    env.reset()
+    env.step(5)
+    forks = env.fork(2)
+    # Each fork starts from the parent's state and goes its own way
+    assert forks[0].step(1)[0][0, 0] == 6
+    assert forks[1].step(2)[0][0, 0] == 7
+    assert forks[0].step(1)[0][0, 0] == 7
+    assert env.step(10)[0][0, 0] == 15
+
+    try:
+        env.fork(1)
+        assert False, 'No exception'
+    except gre.ForkError:
+        pass
+    # A refused fork leaves the parent as it was
+    assert env.step(1)[0][0, 0] == 16
+
+    directories = [fork.bridge.base for fork in forks]
+    for fork in forks:
+        fork.close()
+    end = time.time() + 5
+    while any(os.path.exists(d) for d in directories) and time.time() < end:
+        time.sleep(0.01)
+    assert not any(os.path.exists(d) for d in directories)
+    # Finished forks make room for new ones, once they have exited
+    while True:
+        try:
+            fork = env.fork(1)[0]
+            break
+        except gre.ForkError:
+            assert time.time() < end
+            time.sleep(0.01)
+    assert fork.step(1)[0][0, 0] == 17
+    fork.close()
+
+
+def test_fork_ts_limit(process_wrapper):
+    env = process_wrapper(CounterEnv, wrapper_kwargs={'max_forks': 2}, timestep_limit=5)
+
+    env.reset()
+    # The parent and its fork split the timesteps left, and forks cannot fork
+    fork = env.fork(1)[0]
+    assert fork.ch_fork is None
+    for client in (fork, env):
+        client.step(1)
+        client.step(1)
+        try:
+            client.step(1)
+            assert False, 'Remote did not shut down'
+        except gre.TimestepTimeoutError:
+            pass
+
+
+def test_fork_no_timesteps(process_wrapper):
+    env = process_wrapper(CounterEnv, wrapper_kwargs={'max_forks': 2}, timestep_limit=3)
+
+    env.reset()
+    try:
+        env.fork(2)
+        assert False, 'No exception'
+    except gre.ForkError:
+        pass
+    assert env.step(1)[0][0, 0] == 1
+
+
+def test_persistent(process_wrapper):
+    env = process_wrapper(CounterEnv, timestep_limit=5, persistent=True)
+
+    env.reset()
+    assert env.step(1)[0][0, 0] == 1
+    assert env.step(2)[0][0, 0] == 3
+    env.close()
+
+    # The next agent carries on with the same env and what is left of the budget
+    env = RemoteEnv(env.bridge.base)
+    assert env.step(4)[0][0, 0] == 7
+    env.close()
+    env = RemoteEnv(env.bridge.base)
+    assert env.step(1)[0][0, 0] == 8
+    try:
+        env.step(1)
+    except gre.TimestepTimeoutError:
+        return
+    assert False, 'Remote did not shut down'
+
+
+def test_persistent_mid_step(process_wrapper):
+    env = process_wrapper(SlowEnv, persistent=True)
+
+    env.reset()
+    # The agent goes away before the step is answered
+    env.step_async(1)
+    env.close()
+
+    env = RemoteEnv(env.bridge.base)
+    assert env.step(2)[0][0, 0] == 3
+
+
+def test_persistent_wc_limit(tempdir):
+    bridge = gr.Bridge(tempdir)
+    bridge.listen()
+    # No time is left to wait for another client
+    assert serve(bridge, None, wallclock_limit=0, persistent=True) == 0
+    bridge.close()
+
+
+def test_persistent_preprocess(process_wrapper):
+    env = process_wrapper(FrameEnv, wrapper_kwargs={'allow_preprocess': True}, persistent=True,
+                          client_kwargs={'preprocess': PREPROCESS})
+
+    env.reset()
+    ob = env.step(10)[0]
+    env.close()
+
+    # Observations are already sized for the first agent's preprocessing
+    try:
+        RemoteEnv(env.bridge.base, preprocess=[['grayscale']])
+        assert False, 'No exception'
+    except gre.RequestError:
+        pass
+    env = RemoteEnv(env.bridge.base, preprocess=PREPROCESS)
+    ob = env.step(20)[0]
+    assert (ob[:, :, 0] == 10).all() and (ob[:, :, 1] == 20).all()
+
+
+def test_tcp():
+    import threading
+    from gym_remote.client import RemoteEnv
+    from gym_remote.server import RemoteEnvWrapper
+
+    server = RemoteEnvWrapper(BoxEnv(), 'tcp://127.0.0.1:0', framing='binary', compression='zlib', ob_history=2)
+    thread = threading.Thread(target=server.serve, kwargs={'timestep_limit': 3}, daemon=True)
+    thread.start()
+
+    env = RemoteEnv('tcp://%s:%d' % server.bridge.address)
+    assert env.observation_space.shape == (2, 2)
+    assert (env.reset() == 0).all()
+    ob, rew, done, _ = env.step(7)
+    assert (ob == 7).all()
+    assert (env.step(9)[0] == 9).all()
+    # Inline observations are mirrored into the client's history too
+    assert env.history()[:, 0, 0].tolist() == [7, 9]
+    try:
+        env.step(0)
+    except gre.TimestepTimeoutError:
+        thread.join(1)
+        return
+    except:
+        assert False, 'Incorrect exception'
+    assert False, 'Remote did not shut down'
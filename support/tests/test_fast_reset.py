@@ -0,0 +1,76 @@
+import gym
+import gym.spaces
+import numpy as np
+
+from retro_contest import EmulatorState, FastReset
+
+
+class FakeEmulator:
+    def __init__(self):
+        self.frame = 0
+
+    def get_state(self):
+        return bytes([self.frame])
+
+    def set_state(self, state):
+        self.frame = state[0]
+
+
+class FakeData:
+    def __init__(self):
+        self.resets = 0
+
+    def reset(self):
+        self.resets += 1
+
+    def update_ram(self):
+        pass
+
+
+class EmulatorEnv(gym.Env):
+    def __init__(self):
+        self.action_space = gym.spaces.Discrete(2)
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(2,), dtype=np.uint8)
+        self.em = FakeEmulator()
+        self.data = FakeData()
+        self.full_resets = 0
+
+    def step(self, action):
+        self.em.frame += 1
+        return np.full(2, self.em.frame, np.uint8), 0.0, False, {}
+
+    def reset(self):
+        self.full_resets += 1
+        self.em.frame = 1
+        self.data.reset()
+        return np.full(2, self.em.frame, np.uint8)
+
+
+def test_fast_reset():
+    inner = EmulatorEnv()
+    env = FastReset(inner)
+
+    assert env.reset().tolist() == [1, 1]
+    env.step(0)
+    assert env.step(0)[0].tolist() == [3, 3]
+
+    ob = env.reset()
+    assert ob.tolist() == [1, 1]
+    # Only the first reset went through the env
+    assert inner.full_resets == 1
+    assert inner.data.resets == 2
+    assert env.step(0)[0].tolist() == [2, 2]
+
+    # Returned observations are copies of the snapshot
+    ob[:] = 0
+    assert env.reset().tolist() == [1, 1]
+
+
+def test_emulator_state():
+    env = EmulatorState(EmulatorEnv())
+    env.reset()
+    env.step(0)
+    state = env.get_state()
+    env.step(0)
+    env.set_state(state)
+    assert env.step(0)[0].tolist() == [3, 3]
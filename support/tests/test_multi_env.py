@@ -0,0 +1,95 @@
+import gym_remote.exceptions as gre
+import os
+import threading
+
+from gym_remote.client import RemoteEnv
+from gym_remote.server import MultiRemoteEnvServer
+from . import tempdir
+from .test_env import BitEnv, BoxEnv, StepEnv
+
+
+def start_server(make_env, directory, serve_kwargs={}, **kwargs):
+    server = MultiRemoteEnvServer(make_env, directory, **kwargs)
+    thread = threading.Thread(target=server.serve, kwargs=serve_kwargs, daemon=True)
+    thread.start()
+    return server, thread
+
+
+def test_multi_clients(tempdir):
+    for wrapper_kwargs in ({}, {'wakeup': 'eventfd'}, {'framing': 'binary', 'memory': 'memfd'}):
+        server, thread = start_server(BoxEnv, tempdir, serve_kwargs={'clients': 3}, **wrapper_kwargs)
+        envs = [RemoteEnv(tempdir) for _ in range(3)]
+
+        # Each client has its own channel files
+        if wrapper_kwargs.get('memory') != 'memfd':
+            assert sorted(d for d in os.listdir(tempdir) if d != 'sock') == ['client-1', 'client-2', 'client-3']
+
+        for env in envs:
+            assert (env.reset() == 0).all()
+        for i in range(5):
+            for j, env in enumerate(envs):
+                assert (env.step(i * 3 + j)[0] == i * 3 + j).all()
+
+        for env in envs:
+            env.close()
+        thread.join(5)
+        assert not thread.is_alive()
+        server.close()
+        assert os.listdir(tempdir) == []
+
+
+def test_multi_ts_limit(tempdir):
+    server, thread = start_server(StepEnv, tempdir, serve_kwargs={'clients': 2, 'timestep_limit': 2})
+    first = RemoteEnv(tempdir)
+    second = RemoteEnv(tempdir)
+
+    assert first.step(0) == (0, 1, False, {})
+    assert first.step(0) == (0, 2, False, {})
+    # Limits are per client
+    assert second.step(0) == (0, 1, False, {})
+    try:
+        first.step(0)
+        assert False, 'Remote did not shut down'
+    except gre.TimestepTimeoutError:
+        pass
+    assert second.step(0) == (0, 2, False, {})
+    second.close()
+    thread.join(5)
+    server.close()
+
+
+def test_multi_max_clients(tempdir):
+    server, thread = start_server(BitEnv, tempdir, serve_kwargs={'clients': 2}, max_clients=1)
+    first = RemoteEnv(tempdir)
+    assert first.step(3) == (1, 2.0, False, {})
+
+    envs = []
+    waiting = threading.Thread(target=lambda: envs.append(RemoteEnv(tempdir)), daemon=True)
+    waiting.start()
+    waiting.join(0.2)
+    # The second client is only served once the first leaves
+    assert not envs
+
+    first.close()
+    waiting.join(5)
+    assert envs[0].step(1) == (1, 0.0, False, {})
+    envs[0].close()
+    thread.join(5)
+    server.close()
+
+
+def test_multi_handshake_timeout(tempdir):
+    import socket
+    server, thread = start_server(BoxEnv, tempdir, serve_kwargs={'clients': 2}, handshake_timeout=0.2,
+                                  allow_preprocess=True)
+    # This client never sends the request the server waits for
+    stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stalled.connect(os.path.join(tempdir, 'sock'))
+
+    env = RemoteEnv(tempdir)
+    assert (env.step(7)[0] == 7).all()
+    env.close()
+    stalled.close()
+    thread.join(5)
+    assert not thread.is_alive()
+    server.close()
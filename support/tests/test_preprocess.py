@@ -0,0 +1,52 @@
+import gym.spaces
+import numpy as np
+
+from gym_remote.preprocess import Preprocessor
+
+
+def make_space(shape):
+    return gym.spaces.Box(low=0, high=255, shape=shape, dtype=np.uint8)
+
+
+def test_crop_grayscale_downsample():
+    preprocessor = Preprocessor([['crop', 2, 10, 0, 8], ['grayscale'], ['downsample', 2]], make_space((12, 8, 3)))
+    assert preprocessor.observation_space.shape == (4, 4, 1)
+
+    ob = np.zeros((12, 8, 3), np.uint8)
+    ob[2:4, 0:2] = 100
+    processed = preprocessor(ob)
+    assert processed.shape == (4, 4, 1)
+    assert processed.dtype == np.uint8
+    assert processed[0, 0, 0] == 100
+    assert (processed.reshape(-1)[1:] == 0).all()
+
+
+def test_stack():
+    preprocessor = Preprocessor([['stack', 3]], make_space((1, 1, 1)))
+    assert preprocessor.observation_space.shape == (1, 1, 3)
+
+    assert list(preprocessor.reset(np.full((1, 1, 1), 1, np.uint8)).reshape(-1)) == [1, 1, 1]
+    assert list(preprocessor(np.full((1, 1, 1), 2, np.uint8)).reshape(-1)) == [1, 1, 2]
+    assert list(preprocessor(np.full((1, 1, 1), 3, np.uint8)).reshape(-1)) == [1, 2, 3]
+    assert list(preprocessor.reset(np.full((1, 1, 1), 4, np.uint8)).reshape(-1)) == [4, 4, 4]
+
+
+def test_bad_specs():
+    space = make_space((8, 8, 3))
+    for spec in ([['rotate', 90]], [['crop', 0, 9, 0, 8]], [['downsample', 0]], [['stack', 1000]],
+                 [['grayscale'], ['grayscale']], [['stack', 'x']], [[]], [[['x']]], 5, 'crop', [5], [[5]]):
+        try:
+            Preprocessor(spec, space)
+            assert False, 'No exception for %r' % (spec,)
+        except ValueError:
+            pass
+
+
+def test_bad_specs_1d():
+    space = make_space((8,))
+    for spec in ([['crop', 0, 1, 0, 1]], [['downsample', 2]], [['grayscale']], [['stack', 2]]):
+        try:
+            Preprocessor(spec, space)
+            assert False, 'No exception for %r' % (spec,)
+        except ValueError:
+            pass
@@ -0,0 +1,63 @@
+import gym
+import gym.spaces
+import numpy as np
+import os
+
+from retro_contest import TrajectoryRecorder, iter_trajectories
+from . import tempdir
+
+
+class CountEnv(gym.Env):
+    def __init__(self):
+        self.action_space = gym.spaces.MultiBinary(3)
+        self.observation_space = gym.spaces.Box(low=0, high=255, shape=(2, 2), dtype=np.uint8)
+        self.count = 0
+
+    def step(self, action):
+        self.count += 1
+        return np.full((2, 2), self.count, np.uint8), float(self.count), self.count % 4 == 0, {}
+
+    def reset(self):
+        self.count = 0
+        return np.zeros((2, 2), np.uint8)
+
+
+def test_trajectory_recorder(tempdir):
+    env = TrajectoryRecorder(CountEnv(), tempdir, chunk_size=3)
+    for episode in range(2):
+        env.reset()
+        done = False
+        while not done:
+            _, _, done, _ = env.step(np.array([1, 0, 1], np.uint8))
+    env.close()
+
+    assert sorted(f for f in os.listdir(tempdir) if f.endswith('.json')) == \
+        ['chunk_000000.json', 'chunk_000001.json', 'chunk_000002.json']
+
+    chunks = list(iter_trajectories(tempdir))
+    assert [len(chunk['obs']) for chunk in chunks] == [3, 3, 2]
+    assert isinstance(chunks[0]['obs'], np.memmap)
+
+    obs = np.concatenate([chunk['obs'] for chunk in chunks])
+    rewards = np.concatenate([chunk['rewards'] for chunk in chunks])
+    dones = np.concatenate([chunk['dones'] for chunk in chunks])
+    actions = np.concatenate([chunk['actions'] for chunk in chunks])
+    # Observations are the ones each action was taken on
+    assert obs[:, 0, 0].tolist() == [0, 1, 2, 3] * 2
+    assert rewards.tolist() == [1, 2, 3, 4] * 2
+    assert dones.tolist() == [False, False, False, True] * 2
+    assert (actions == [1, 0, 1]).all()
+
+
+def test_trajectory_recorder_shared_action(tempdir):
+    env = TrajectoryRecorder(CountEnv(), tempdir, chunk_size=4)
+    env.reset()
+    # Actions read from a channel are reused buffers
+    action = np.zeros(3, np.uint8)
+    for i in range(4):
+        action[:] = i
+        env.step(action)
+    env.close()
+
+    actions = next(iter_trajectories(tempdir))['actions']
+    assert actions[:, 0].tolist() == [0, 1, 2, 3]
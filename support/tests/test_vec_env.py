@@ -0,0 +1,202 @@
+import gym_remote.exceptions as gre
+import numpy as np
+import os
+import pytest
+
+from . import process_vec_wrapper, process_pool_wrapper, tempdir
+from .test_env import BitEnv, MultiBitEnv, StepEnv, BoxEnv
+
+
+def test_vec_split(process_vec_wrapper):
+    env = process_vec_wrapper(BitEnv, wrapper_kwargs={'num_envs': 3})
+
+    assert env.num_envs == 3
+    assert env.action_space.n == 8
+    assert env.observation_space.n == 2
+
+    ob, rew, done, info = env.step([0, 1, 3])
+    assert (ob == [0, 1, 1]).all()
+    assert (rew == [0, 0, 2]).all()
+    assert (done == [False, False, False]).all()
+    assert len(info) == 3
+
+
+def test_vec_multibinary(process_vec_wrapper):
+    env = process_vec_wrapper(MultiBitEnv)
+
+    assert env.action_space.n == 3
+
+    ob, rew, done, _ = env.step(np.array([[1, 0, 0], [0, 1, 1]], np.uint8))
+    assert (ob == [1, 0]).all()
+    assert (rew == [0, 1]).all()
+    assert (done == [False, True]).all()
+
+
+def test_vec_box(process_vec_wrapper):
+    env = process_vec_wrapper(BoxEnv, wrapper_kwargs={'ob_slots': 2})
+
+    assert env.observation_space.shape == (2, 2)
+
+    ob = env.reset()
+    assert ob.shape == (2, 2, 2)
+    assert (ob == 0).all()
+    ob1 = env.step([1, 2])[0]
+    ob2 = env.step([3, 4])[0]
+    assert (ob1[0] == 1).all() and (ob1[1] == 2).all()
+    assert (ob2[0] == 3).all() and (ob2[1] == 4).all()
+
+
+def test_vec_autoreset(process_vec_wrapper):
+    env = process_vec_wrapper(StepEnv)
+
+    env.reset()
+    ob, rew, done, _ = env.step([0, 0])
+    assert (rew == [1, 1]).all()
+    ob, rew, done, _ = env.step([1, 0])
+    assert (rew == [2, 2]).all()
+    assert (done == [True, False]).all()
+    ob, rew, done, _ = env.step([0, 0])
+    assert (rew == [1, 3]).all()
+    assert (done == [False, False]).all()
+
+
+def test_vec_step_async(process_vec_wrapper):
+    env = process_vec_wrapper(BitEnv)
+
+    env.step_async([1, 2])
+    ob, rew, done, _ = env.step_wait()
+    assert (ob == [1, 0]).all()
+    assert (rew == [0, 2]).all()
+
+
+def test_vec_ts_limit(process_vec_wrapper):
+    env = process_vec_wrapper(StepEnv, timestep_limit=4)
+
+    env.step([0, 0])
+    env.step([0, 0])
+    try:
+        env.step([0, 0])
+    except gre.TimestepTimeoutError:
+        return
+    except:
+        assert False, 'Incorrect exception'
+    assert False, 'Remote did not shut down'
+
+
+class PidEnv(BoxEnv):
+    def step(self, action):
+        ob, rew, done, info = BoxEnv.step(self, action)
+        return ob, os.getpid(), done, info
+
+
+class ExitEnv(BoxEnv):
+    def step(self, action):
+        if action:
+            os._exit(1)
+        return BoxEnv.step(self, action)
+
+
+def test_pool_box(process_pool_wrapper):
+    env = process_pool_wrapper(BoxEnv, wrapper_kwargs={'num_envs': 3, 'ob_slots': 2})
+
+    assert env.num_envs == 3
+    assert env.observation_space.shape == (2, 2)
+
+    ob = env.reset()
+    assert ob.shape == (3, 2, 2)
+    assert (ob == 0).all()
+    ob1 = env.step([1, 2, 3])[0]
+    ob2 = env.step([4, 5, 6])[0]
+    assert [ob1[i, 0, 0] for i in range(3)] == [1, 2, 3]
+    assert [ob2[i, 0, 0] for i in range(3)] == [4, 5, 6]
+
+
+def test_pool_workers(process_pool_wrapper):
+    env = process_pool_wrapper(PidEnv, wrapper_kwargs={'num_envs': 3})
+
+    env.reset()
+    _, rew, _, _ = env.step([0, 0, 0])
+    # Every env runs in its own process
+    assert len(set(rew)) == 3
+    assert os.getpid() not in rew
+
+
+def test_pool_autoreset(process_pool_wrapper):
+    env = process_pool_wrapper(StepEnv)
+
+    env.reset()
+    env.step([0, 0])
+    ob, rew, done, _ = env.step([1, 0])
+    assert (rew == [2, 2]).all()
+    assert (done == [True, False]).all()
+    ob, rew, done, _ = env.step([0, 0])
+    assert (rew == [1, 3]).all()
+
+
+def _alive(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except OSError:
+        return False
+
+
+def test_pool_server_killed(tempdir):
+    import multiprocessing
+    import time
+    from gym_remote.client import VecRemoteEnv
+    from gym_remote.server import ProcessVecRemoteEnvWrapper
+
+    if not os.path.exists('/proc/self/stat'):
+        pytest.skip('Needs /proc')
+
+    def serve():
+        ProcessVecRemoteEnvWrapper(PidEnv, 2, tempdir).serve()
+
+    proc = multiprocessing.Process(target=serve)
+    proc.start()
+    while not os.path.exists(os.path.join(tempdir, 'sock')):
+        time.sleep(0.01)
+    env = VecRemoteEnv(tempdir)
+    env.reset()
+    pids = [int(pid) for pid in env.step([0, 0])[1]]
+    assert all(_alive(pid) for pid in pids)
+    proc.terminate()
+    proc.join()
+    end = time.time() + 5
+    while any(_alive(pid) for pid in pids) and time.time() < end:
+        time.sleep(0.01)
+    assert not any(_alive(pid) for pid in pids)
+
+
+def test_pool_worker_exit(process_pool_wrapper):
+    env = process_pool_wrapper(ExitEnv)
+
+    env.reset()
+    env.step([0, 0])
+    try:
+        env.step([1, 0])
+    except gre.WorkerDisconnectError:
+        return
+    except:
+        assert False, 'Incorrect exception'
+    assert False, 'Remote did not shut down'
+
+
+def test_pool_tcp():
+    import threading
+    from gym_remote.client import VecRemoteEnv
+    from gym_remote.server import ProcessVecRemoteEnvWrapper
+
+    # Inline observations are filled by the workers too
+    server = ProcessVecRemoteEnvWrapper(BoxEnv, 2, 'tcp://127.0.0.1:0', framing='binary')
+    thread = threading.Thread(target=server.serve, daemon=True)
+    thread.start()
+
+    env = VecRemoteEnv('tcp://%s:%d' % server.bridge.address)
+    env.reset()
+    ob = env.step([5, 6])[0]
+    assert ob[0, 0, 0] == 5 and ob[1, 0, 0] == 6
+    env.close()
+    thread.join(1)
+    server.close()